@@ -5,21 +5,20 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
 from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from datetime import datetime
 from openpyxl import load_workbook
 from openpyxl.styles import Font
+# Misma resolución del chromedriver que menu.py: ruta fija, caché de
+# webdriver-manager o PATH, y solo como último recurso se descarga
+from menu import ruta_chromedriver
 
 # Obtener la fecha y hora actual
 timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 num_version = "141.0.7390.108"
 
-CHROMEDRIVER_PATH = ChromeDriverManager(
-    driver_version=num_version).install()
-
 # Configura el driver y el navegador
 
 
@@ -37,7 +36,7 @@ def configurar_driver(num_version: str):
     options.add_argument('--ignore-ssl-errors')
 
     driver = webdriver.Chrome(
-        service=Service(CHROMEDRIVER_PATH),
+        service=Service(ruta_chromedriver(num_version)),
         options=options
     )
 
@@ -0,0 +1,337 @@
+"""
+Banco de pruebas de la etapa de recolección contra la flota simulada de
+simulador_ews.py (nada sale a la red real).
+
+Para cada tamaño de flota levanta el simulador, y para cada motor y nivel
+de concurrencia corre escanear_flota en un proceso aparte, de modo que la
+memoria y la CPU medidas sean solo las de esa corrida. Motores:
+  - chrome-por-ip: un Chrome nuevo por impresora (como antes del pool)
+  - chrome-pool: PoolDrivers
+  - chrome-pestanas: PestanasChrome
+  - http: sesión requests sin navegador
+  - snmp: la misma hoja leída por SNMP
+Los motores Chrome se informan como no disponibles si no hay navegador.
+
+El resultado va a un JSON que se puede pasar a --comparar en la próxima
+corrida para ver las diferencias.
+
+Uso:
+    python benchmark_colectores.py --tamanos 10 100 500 --salida bench.json
+    python benchmark_colectores.py --motores http snmp --concurrencias 5 20 auto
+    python benchmark_colectores.py --comparar bench_anterior.json --salida bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource  # No existe en Windows
+except ImportError:
+    resource = None
+
+MOTORES = ("chrome-por-ip", "chrome-pool", "chrome-pestanas", "http", "snmp")
+HOJA = "HP Admin"
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+class MonitorRecursos:
+    """
+    Muestrea cada `intervalo` segundos la memoria del proceso y de sus hijos
+    (chromedriver, Chrome) y guarda el pico. Sin psutil usa getrusage, que
+    solo da el pico del propio proceso.
+    """
+
+    def __init__(self, intervalo=0.1):
+        self.intervalo = intervalo
+        self.rss_pico = 0
+        self._cpu_hijos = {}
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._proceso = psutil.Process() if psutil else None
+
+    def _muestrear(self):
+        while not self._parar.is_set():
+            self._tomar_muestra()
+            self._parar.wait(self.intervalo)
+
+    def _tomar_muestra(self):
+        if self._proceso is None:
+            return
+        rss = self._proceso.memory_info().rss
+        for hijo in self._proceso.children(recursive=True):
+            try:
+                rss += hijo.memory_info().rss
+                tiempos = hijo.cpu_times()
+                self._cpu_hijos[hijo.pid] = tiempos.user + tiempos.system
+            except psutil.Error:
+                continue
+        self.rss_pico = max(self.rss_pico, rss)
+
+    def __enter__(self):
+        self._inicio = time.monotonic()
+        self._cpu_inicio = self._cpu_propia()
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._tomar_muestra()
+        self._parar.set()
+        self._hilo.join()
+        self.segundos = time.monotonic() - self._inicio
+        self.cpu_segundos = self._cpu_propia() - self._cpu_inicio + sum(self._cpu_hijos.values())
+
+    def _cpu_propia(self):
+        if self._proceso is not None:
+            tiempos = self._proceso.cpu_times()
+            return tiempos.user + tiempos.system
+        tiempos = os.times()
+        return tiempos.user + tiempos.system
+
+    def resumen(self):
+        rss = self.rss_pico
+        if not rss and resource is not None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KB en Linux
+        return {
+            'rss_pico_mb': round(rss / 2**20, 1) if rss else None,
+            'cpu_segundos': round(self.cpu_segundos, 2),
+            'cpu_promedio_pct': round(100 * self.cpu_segundos / self.segundos, 1) if self.segundos else None,
+        }
+
+
+# Una corrida (proceso hijo)
+
+def correr_una(motor, concurrencia, ruta_mapa):
+    import asyncio
+    import menu
+
+    menu.cargar_mapa_ips(ruta_mapa)
+    with open(ruta_mapa, encoding="utf-8") as f:
+        ips = list(json.load(f))
+
+    if motor == "snmp":
+        menu.PERFILES_POR_HOJA[HOJA] = {**menu.PERFILES_POR_HOJA[HOJA], 'motor': "snmp"}
+    elif motor.startswith("chrome"):
+        # Sin Chrome la corrida mediría solo errores: se avisa y no se corre
+        try:
+            menu.configurar_driver(menu.num_version).quit()
+        except Exception as e:
+            return {'disponible': False, 'error': f"{type(e).__name__}: {e}".strip()[:300]}
+
+    if concurrencia == "auto":
+        controlador = (menu.ControladorConcurrencia(inicial=10, maximo=50)
+                       if motor == "chrome-pestanas" else menu.ControladorConcurrencia())
+    else:
+        controlador = menu.ControladorConcurrencia(
+            inicial=concurrencia, minimo=concurrencia, maximo=concurrencia)
+
+    sesion = menu.crear_sesion_http(tamano=controlador.maximo) if motor == "http" else None
+    navegador = {
+        "chrome-pool": lambda: menu.PoolDrivers(tamano=controlador.maximo),
+        "chrome-pestanas": lambda: menu.PestanasChrome(pestanas=controlador.maximo),
+    }.get(motor, lambda: None)()
+
+    # Latencia por impresora: se envuelve el colector que usa escanear_flota
+    latencias = []
+    colector_original = menu.colector_de_hoja
+
+    def colector_medido(sheet_name, perfil=None):
+        colector = colector_original(sheet_name, perfil)
+
+        def medido(ip, pool=None, sesion=None):
+            if not ip:
+                return colector(ip, pool, sesion)
+            inicio = time.perf_counter()
+            try:
+                return colector(ip, pool, sesion)
+            finally:
+                latencias.append(time.perf_counter() - inicio)
+        return medido
+
+    menu.colector_de_hoja = colector_medido
+    try:
+        with MonitorRecursos() as monitor:
+            resultados = asyncio.run(menu.escanear_flota(
+                {HOJA: ips}, navegador, sesion, controlador))
+    finally:
+        menu.colector_de_hoja = colector_original
+        if navegador is not None:
+            navegador.cerrar()
+
+    return {
+        'disponible': True,
+        'segundos': round(monitor.segundos, 3),
+        'impresoras_por_segundo': round(len(ips) / monitor.segundos, 2),
+        'latencia_s': {nombre: round(percentil(latencias, p), 4) if latencias else None
+                       for nombre, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))},
+        'estados': dict(Counter(r['Estado'] for r in resultados[HOJA])),
+        'concurrencia_final': controlador.limite,
+        **monitor.resumen(),
+    }
+
+
+# Orquestación (proceso padre)
+
+def levantar_simulador(tamano, opciones, ruta_mapa):
+    if os.path.exists(ruta_mapa):
+        os.remove(ruta_mapa)
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.join(DIRECTORIO, "simulador_ews.py"),
+         "--hp", str(tamano), "--samsung", "0", "--clx", "0",
+         "--puerto-base", str(opciones.puerto_base),
+         "--latencia", str(opciones.latencia), "--jitter", str(opciones.jitter),
+         "--semilla", str(opciones.semilla), "--mapa", ruta_mapa],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # El simulador escribe el mapa cuando ya están todos los servidores arriba
+    limite = time.monotonic() + 60
+    while not os.path.exists(ruta_mapa):
+        if proceso.poll() is not None or time.monotonic() > limite:
+            proceso.kill()
+            raise RuntimeError(f"El simulador no arrancó con {tamano} impresoras")
+        time.sleep(0.1)
+    time.sleep(0.2)  # el mapa puede estar a medio escribir
+    return proceso
+
+
+def lanzar_corrida(motor, concurrencia, ruta_mapa, limite):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        ruta_resultado = f.name
+    try:
+        proceso = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--una", motor, str(concurrencia),
+             ruta_mapa, ruta_resultado],
+            cwd=DIRECTORIO, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            timeout=limite, text=True)
+        if proceso.returncode != 0:
+            return {'disponible': False, 'error': proceso.stderr.strip().splitlines()[-1:]}
+        with open(ruta_resultado, encoding="utf-8") as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {'disponible': False, 'error': f"superó el límite de {limite} s"}
+    finally:
+        os.remove(ruta_resultado)
+
+
+def describir_equipo():
+    return {
+        'sistema': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'memoria_mb': round(psutil.virtual_memory().total / 2**20) if psutil else None,
+    }
+
+
+def comparar(anterior, actual):
+    """Imprime las diferencias con una corrida anterior, por caso."""
+    clave = lambda c: (c['motor'], str(c['concurrencia']), c['impresoras'])
+    previas = {clave(c): c for c in anterior['corridas'] if c.get('disponible')}
+    print(f"\nComparación con la corrida del {anterior['fecha']}:")
+    for corrida in actual['corridas']:
+        previa = previas.get(clave(corrida))
+        if not corrida.get('disponible') or previa is None:
+            continue
+        lineas = []
+        for nombre, ahora, antes in (
+                ("imp/s", corrida['impresoras_por_segundo'], previa['impresoras_por_segundo']),
+                ("p95", corrida['latencia_s']['p95'], previa['latencia_s']['p95']),
+                ("RSS MB", corrida['rss_pico_mb'], previa['rss_pico_mb'])):
+            if ahora is None or antes is None:
+                continue
+            cambio = f" ({(ahora - antes) / antes:+.0%})" if antes else ""
+            lineas.append(f"{nombre} {antes} -> {ahora}{cambio}")
+        print(f"  {corrida['motor']:16} c={str(corrida['concurrencia']):4} "
+              f"n={corrida['impresoras']:<4} " + " | ".join(lineas))
+
+
+def argumentos(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark de los colectores contra la flota simulada")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--motores", nargs="+", choices=MOTORES, default=list(MOTORES))
+    parser.add_argument("--concurrencias", nargs="+", default=["5", "20", "50"],
+                        help="límites fijos, o 'auto' para el ajuste AIMD")
+    parser.add_argument("--latencia", type=int, default=100, help="ms de demora del simulador")
+    parser.add_argument("--jitter", type=int, default=50)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--puerto-base", type=int, default=18000)
+    parser.add_argument("--limite", type=int, default=1800, help="segundos máximos por corrida")
+    parser.add_argument("--salida", default=f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument("--comparar", default=None, help="JSON de una corrida anterior")
+    parser.add_argument("--una", nargs=4, metavar=("MOTOR", "CONCURRENCIA", "MAPA", "RESULTADO"),
+                        help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+def main():
+    opciones = argumentos()
+
+    if opciones.una:
+        motor, concurrencia, ruta_mapa, ruta_resultado = opciones.una
+        concurrencia = concurrencia if concurrencia == "auto" else int(concurrencia)
+        resultado = correr_una(motor, concurrencia, ruta_mapa)
+        with open(ruta_resultado, "w", encoding="utf-8") as f:
+            json.dump(resultado, f)
+        return
+
+    informe = {
+        'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'equipo': describir_equipo(),
+        'parametros': {k: v for k, v in vars(opciones).items() if k not in ('una', 'comparar', 'salida')},
+        'corridas': [],
+    }
+    ruta_mapa = os.path.join(tempfile.gettempdir(), f"mapa_benchmark_{os.getpid()}.json")
+
+    for tamano in opciones.tamanos:
+        simulador = levantar_simulador(tamano, opciones, ruta_mapa)
+        try:
+            for motor in opciones.motores:
+                for concurrencia in opciones.concurrencias:
+                    print(f"{tamano} impresoras | {motor} | concurrencia {concurrencia}...", flush=True)
+                    resultado = lanzar_corrida(motor, concurrencia, ruta_mapa, opciones.limite)
+                    informe['corridas'].append({'motor': motor, 'concurrencia': concurrencia,
+                                                'impresoras': tamano, **resultado})
+                    if resultado.get('disponible'):
+                        print(f"  {resultado['impresoras_por_segundo']} imp/s | "
+                              f"p50 {resultado['latencia_s']['p50']} s | p95 {resultado['latencia_s']['p95']} s | "
+                              f"p99 {resultado['latencia_s']['p99']} s | RSS {resultado['rss_pico_mb']} MB | "
+                              f"CPU {resultado['cpu_promedio_pct']}% | {resultado['estados']}")
+                    else:
+                        print(f"  no disponible: {resultado.get('error')}")
+                        if motor.startswith("chrome") and "límite" not in str(resultado.get('error')):
+                            break  # las demás concurrencias tampoco van a tener Chrome
+        finally:
+            simulador.terminate()
+            simulador.wait()
+            if os.path.exists(ruta_mapa):
+                os.remove(ruta_mapa)
+
+    with open(opciones.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {opciones.salida}")
+
+    if opciones.comparar:
+        with open(opciones.comparar, encoding="utf-8") as f:
+            comparar(json.load(f), informe)
+
+
+if __name__ == "__main__":
+    main()
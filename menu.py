@@ -1,34 +1,146 @@
-import pandas as pd
+import time
+
+# Marca de inicio para el informe de --startup-profile
+_INICIO_IMPORTS = time.perf_counter()
+
 import re
+import argparse
+import asyncio
+import glob
+import heapq
+import importlib
+import importlib.util
+import json
+import math
+import os
+import shutil
+import queue
+import random
+import socket
+import sys
+import threading
+from collections import deque
+from html.parser import HTMLParser
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from selenium import webdriver
-from selenium.webdriver.common.by import By
+# Solo las clases de excepción (no cargan WebDriver); el resto de selenium
+# se importa en configurar_driver
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from datetime import datetime, timedelta
-from openpyxl import load_workbook
-from openpyxl.styles import Font
-import numpy as np
-from sklearn.linear_model import LinearRegression
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 
-# Obtener la fecha y hora actual
-timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+def importar_diferido(nombre):
+    """
+    Devuelve el módulo `nombre` sin cargarlo: la importación real ocurre la
+    primera vez que se usa un atributo. Así el menú abre sin pagar pandas.
+    """
+    if nombre in sys.modules:
+        return sys.modules[nombre]
+    spec = importlib.util.find_spec(nombre)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nombre] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+# pandas y numpy se usan en casi todo el archivo, pero recién al elegir una
+# opción. openpyxl y scikit-learn se importan dentro de las funciones.
+pd = importar_diferido("pandas")
+np = importar_diferido("numpy")
+# requests solo hace falta para consultar impresoras, no para predecir
+requests = importar_diferido("requests")
+urllib3 = importar_diferido("urllib3")
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+_FIN_IMPORTS = time.perf_counter()
+
+def marca_de_tiempo():
+    """Fecha y hora actual: cada lectura lleva la hora en que se tomó."""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
 
 num_version = "141.0.7390.108"
 
-CHROMEDRIVER_PATH = ChromeDriverManager(
-    driver_version=num_version).install()
+# "http": lee el EWS sin navegador y usa Selenium solo como respaldo
+# "selenium": siempre abre Chrome
+MOTOR_HP = "http"
+
+# "pool": varios Chrome (PoolDrivers)
+# "pestanas": un solo Chrome con una pestaña por impresora (PestanasChrome)
+MODO_NAVEGADOR = "pool"
+
+# Ruta fija a un chromedriver local (o variable de entorno CHROMEDRIVER_PATH).
+# Si no hay, se usa el que webdriver-manager ya dejó en su caché y solo
+# como último recurso se descarga.
+CHROMEDRIVER_PATH = os.environ.get("CHROMEDRIVER_PATH", "")
+
+_ruta_chromedriver = None
+_lock_chromedriver = threading.Lock()
+
+
+def _chromedriver_en_cache(version):
+    # Misma estructura que usa webdriver-manager: ~/.wdm/drivers/chromedriver/<so>/<versión>/...
+    base = os.environ.get("WDM_CACHE", os.path.join(
+        os.path.expanduser("~"), ".wdm"))
+    patron = os.path.join(base, "drivers", "chromedriver",
+                          "*", version, "**", "chromedriver*")
+    for ruta in sorted(glob.glob(patron, recursive=True)):
+        if os.path.basename(ruta) in ("chromedriver", "chromedriver.exe") and os.path.isfile(ruta):
+            return ruta
+    return None
+
+
+def ruta_chromedriver(version=None):
+    """
+    Resuelve el chromedriver la primera vez que se abre un navegador y
+    recuerda el resultado. Funciona sin red si hay una ruta fija, uno en la
+    caché de webdriver-manager o uno en el PATH.
+    """
+    global _ruta_chromedriver
+    with _lock_chromedriver:
+        if _ruta_chromedriver:
+            return _ruta_chromedriver
+
+        version = version or num_version
+        ruta = (CHROMEDRIVER_PATH if os.path.isfile(CHROMEDRIVER_PATH) else None) \
+            or _chromedriver_en_cache(version) \
+            or shutil.which("chromedriver")
+        if not ruta:
+            from webdriver_manager.chrome import ChromeDriverManager
+            ruta = ChromeDriverManager(driver_version=version).install()
+
+        _ruta_chromedriver = ruta
+        return ruta
+
+# Modo liviano: el navegador no descarga lo que el lector no usa (imágenes,
+# multimedia, fuentes y hojas de estilo) y no espera a que termine de cargar
+# la página, solo al DOM; JS_EXTRAER_CAMPOS ya espera a los elementos.
+MODO_LIVIANO = True
+
+BLOQUEOS_LIVIANO = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.bmp", "*.ico", "*.svg", "*.webp",
+    "*.mp3", "*.mp4", "*.webm", "*.avi",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.css",
+]
 
 # Configura el driver y el navegador
 
 
-def configurar_driver(num_version: str):
+def configurar_driver(num_version: str, liviano=None, carga=None):
+    """
+    `carga` fuerza la estrategia de carga de páginas de Selenium ('none',
+    'eager' o 'normal'); por omisión depende del modo liviano.
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
+    liviano = MODO_LIVIANO if liviano is None else liviano
     options = webdriver.ChromeOptions()
     options.add_argument('--headless')
     options.add_argument('--disable-gpu')
@@ -40,14 +152,486 @@ def configurar_driver(num_version: str):
     # options.add_argument('--window-size=1080,1080')
     options.add_argument('--ignore-certificate-errors')  # Ignorar errores SSL
     options.add_argument('--ignore-ssl-errors')
+    if liviano:
+        options.page_load_strategy = 'eager'
+        options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2})
+    if carga:
+        options.page_load_strategy = carga
 
     driver = webdriver.Chrome(
-        service=Service(CHROMEDRIVER_PATH),
+        service=Service(ruta_chromedriver(num_version)),
         options=options
     )
+    # Margen para JS_EXTRAER_CAMPOS, que maneja su propio timeout
+    driver.set_script_timeout(30)
+
+    driver.liviano = liviano
+    driver.bloqueos = {}
+    bloquear_recursos(driver)
 
     return driver
 
+
+def bloquear_recursos(driver, permitir=(), pestana=None):
+    """
+    Ajusta por CDP las URLs que el navegador no descarga. `permitir` son
+    patrones de BLOQUEOS_LIVIANO que el perfil necesita (p. ej. "*.css").
+    Los bloqueos son de cada pestaña: `pestana` es la que está activa.
+    """
+    if not getattr(driver, 'liviano', False):
+        return
+    bloqueos = [patron for patron in BLOQUEOS_LIVIANO if patron not in permitir]
+    # El mismo navegador atiende varios perfiles: solo se llama si cambia
+    if bloqueos != driver.bloqueos.get(pestana):
+        if pestana not in driver.bloqueos:
+            driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": bloqueos})
+        driver.bloqueos[pestana] = bloqueos
+
+# Pool de navegadores reutilizables entre impresoras
+
+
+class PoolDrivers:
+    """
+    Pool acotado de navegadores headless. Se abren como máximo `tamano`
+    instancias de Chrome por ejecución y cada hilo toma una, la usa para una
+    impresora y la devuelve limpia (about:blank + cookies borradas).
+    """
+
+    def __init__(self, tamano=5, version=None):
+        self.tamano = tamano
+        self.version = version or num_version
+        self._libres = queue.Queue()
+        self._todos = []
+        self._lock = threading.Lock()
+
+    def obtener(self):
+        while True:
+            try:
+                return self._libres.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                crear = len(self._todos) < self.tamano
+                if crear:
+                    # Se reserva el cupo antes de arrancar Chrome (es lento)
+                    self._todos.append(None)
+
+            if crear:
+                break
+
+            try:
+                return self._libres.get(timeout=1)
+            except queue.Empty:
+                # Puede haberse liberado un cupo por un navegador descartado
+                continue
+
+        try:
+            driver = configurar_driver(self.version)
+        except Exception:
+            with self._lock:
+                self._todos.remove(None)
+            raise
+
+        with self._lock:
+            self._todos[self._todos.index(None)] = driver
+        return driver
+
+    def devolver(self, driver):
+        try:
+            driver.get("about:blank")
+            driver.delete_all_cookies()
+        except WebDriverException:
+            # El navegador quedó inutilizable: se descarta y se libera el cupo
+            self._descartar(driver)
+            return
+        self._libres.put(driver)
+
+    def _descartar(self, driver):
+        with self._lock:
+            if driver in self._todos:
+                self._todos.remove(driver)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def cerrar(self):
+        with self._lock:
+            drivers = [d for d in self._todos if d is not None]
+            self._todos = []
+        while not self._libres.empty():
+            self._libres.get_nowait()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except WebDriverException:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+class PestanasChrome:
+    """
+    Un solo Chrome headless con hasta `pestanas` pestañas, una por impresora
+    en curso. WebDriver atiende un comando a la vez, así que las órdenes se
+    turnan con un lock, pero son cortas: cada pestaña solo navega y luego se
+    revisa cada tanto, mientras las páginas cargan todas en paralelo.
+    El navegador usa la estrategia de carga 'none': chromedriver no espera
+    a que termine de cargar ninguna pestaña antes de atender una orden, así
+    una impresora colgada no frena al resto y el `timeout` del perfil se
+    cumple. `timeout_carga` acota además las navegaciones con get().
+    Se usa en lugar de PoolDrivers (mismo parámetro `pool`).
+    """
+
+    def __init__(self, pestanas=50, version=None, intervalo=0.25, timeout_carga=30):
+        self.pestanas = pestanas
+        self.version = version or num_version
+        self.intervalo = intervalo
+        self.timeout_carga = timeout_carga
+        self.driver = None
+        self._libres = queue.Queue()
+        self._abiertas = 0
+        self._lock = threading.Lock()
+
+    def _tomar(self):
+        while True:
+            try:
+                return self._libres.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                if self.driver is None:
+                    self.driver = configurar_driver(self.version, carga='none')
+                    self.driver.set_page_load_timeout(self.timeout_carga)
+                    self._abiertas = 1
+                    return self.driver.current_window_handle
+                if self._abiertas < self.pestanas:
+                    self.driver.switch_to.new_window('tab')
+                    self._abiertas += 1
+                    return self.driver.current_window_handle
+
+            try:
+                return self._libres.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def _devolver(self, pestana):
+        with self._lock:
+            try:
+                self.driver.switch_to.window(pestana)
+            except WebDriverException:
+                # La pestaña ya no existe
+                self._descartar(pestana)
+                return
+            try:
+                self.driver.get("about:blank")
+            except WebDriverException:
+                # Pestaña rota: se cierra y se libera el cupo
+                try:
+                    self.driver.close()
+                except WebDriverException:
+                    pass
+                self._descartar(pestana)
+                return
+        self._libres.put(pestana)
+
+    def _descartar(self, pestana):
+        # Se llama con el lock tomado
+        self._abiertas -= 1
+        self.driver.bloqueos.pop(pestana, None)
+        if self._abiertas == 0:
+            # Sin pestañas el navegador no sirve: el próximo _tomar abre otro
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+
+    def leer(self, url, perfil):
+        """Igual que JS_EXTRAER_CAMPOS, pero en una pestaña propia."""
+        argumentos = (perfil.get('espera'),
+                      [[col, list(loc)] for col, loc in perfil['campos'].items()],
+                      perfil.get('frame'),
+                      perfil.get('opcionales', False))
+        pestana = self._tomar()
+        try:
+            with self._lock:
+                self.driver.switch_to.window(pestana)
+                bloquear_recursos(self.driver, perfil.get('permitir', ()), pestana)
+                # Navega sin esperar a que cargue la página
+                self.driver.execute_script("window.location.href = arguments[0];", url)
+
+            limite = time.monotonic() + perfil['timeout']
+            while True:
+                time.sleep(self.intervalo)
+                with self._lock:
+                    self.driver.switch_to.window(pestana)
+                    resultado = self.driver.execute_script(
+                        JS_REVISAR_CAMPOS, *argumentos)
+                if resultado:
+                    return resultado
+                if time.monotonic() > limite:
+                    return {'error': 'timeout'}
+        finally:
+            self._devolver(pestana)
+
+    def cerrar(self):
+        with self._lock:
+            if self.driver is not None:
+                try:
+                    self.driver.quit()
+                except WebDriverException:
+                    pass
+            self.driver = None
+            self._abiertas = 0
+        while not self._libres.empty():
+            self._libres.get_nowait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+def obtener_driver(pool=None):
+    # Sin pool se mantiene el comportamiento de un Chrome por impresora
+    if pool is None:
+        return configurar_driver(num_version)
+    return pool.obtener()
+
+
+def liberar_driver(driver, pool=None):
+    if pool is None:
+        driver.quit()
+    else:
+        pool.devolver(driver)
+
+# Lectura de las páginas web de las impresoras
+
+
+def crear_sesion_http(tamano=10):
+    """
+    Sesión HTTP compartida por los hilos, con un pool de conexiones del mismo
+    tamaño que la cantidad de trabajadores.
+    """
+    sesion = requests.Session()
+    adaptador = requests.adapters.HTTPAdapter(
+        pool_connections=tamano, pool_maxsize=tamano, max_retries=0)
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    sesion.verify = False  # Los EWS usan certificados autofirmados
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    return sesion
+
+
+class _LectorPorId(HTMLParser):
+    """Junta el texto de los elementos cuyos id están en `ids`."""
+
+    ETIQUETAS_VACIAS = {"br", "img", "input", "meta", "link", "hr", "col",
+                        "area", "base", "source", "wbr"}
+
+    def __init__(self, ids):
+        super().__init__()
+        self.ids = set(ids)
+        self.textos = {}
+        self._actual = None
+        self._profundidad = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._actual is not None:
+            if tag not in self.ETIQUETAS_VACIAS:
+                self._profundidad += 1
+            return
+        id_elemento = dict(attrs).get("id")
+        if id_elemento in self.ids and id_elemento not in self.textos:
+            self._actual = id_elemento
+            self._profundidad = 1
+            self.textos[id_elemento] = []
+            if tag in self.ETIQUETAS_VACIAS:
+                self._actual = None
+
+    def handle_endtag(self, tag):
+        if self._actual is None:
+            return
+        self._profundidad -= 1
+        if self._profundidad == 0:
+            self._actual = None
+
+    def handle_data(self, data):
+        if self._actual is not None:
+            self.textos[self._actual].append(data)
+
+    def resultado(self):
+        # Igual que WebElement.text: espacios colapsados y sin bordes
+        return {k: " ".join("".join(v).split()) for k, v in self.textos.items()}
+
+
+def leer_ids_http(url, sesion, ids, espera, timeout=5):
+    """
+    Descarga la página por HTTP plano y devuelve {id: texto}. Devuelve None
+    cuando el HTML no trae el elemento `espera` (la página se arma con
+    JavaScript) o el servidor responde con error, para que se use Selenium.
+    Los errores de conexión se propagan: la impresora no está en la red.
+    """
+    respuesta = sesion.get(url, timeout=timeout)
+    if respuesta.status_code != 200:
+        return None
+
+    lector = _LectorPorId(list(ids) + [espera])
+    lector.feed(respuesta.text)
+    textos = lector.resultado()
+    if espera not in textos:
+        return None
+    return textos
+
+
+def admite_http(perfil):
+    """Solo las páginas sin frames y ubicadas por id se leen sin navegador."""
+    localizadores = list(perfil['campos'].values()) + [perfil['espera']]
+    return perfil.get('frame') is None and all(
+        loc is not None and loc[0] == "id" for loc in localizadores)
+
+
+# Script que espera la página (y el frame, si hay) y devuelve el texto de
+# todos los campos como un objeto JSON. Argumentos: espera, campos, frame,
+# timeout en ms, opcionales y el callback de execute_async_script. Con
+# `opcionales` un campo que no está vale '' en vez de dar error.
+_JS_REVISAR = """
+function buscar(doc, loc) {
+    if (loc[0] === 'id') return doc.getElementById(loc[1]);
+    if (loc[0] === 'xpath') return doc.evaluate(loc[1], doc, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    return doc.querySelector(loc[1]);
+}
+
+function documento() {
+    if (!frame) return document;
+    var f = buscar(document, frame);
+    try { return f && f.contentDocument; } catch (e) { return null; }
+}
+
+// null mientras la página no esté lista
+function revisar() {
+    if (location.protocol === 'chrome-error:') return {error: 'red'};
+    var doc = documento();
+    var presente = function (c) { return buscar(doc, c[1]); };
+    var cargada = doc && (espera ? buscar(doc, espera) :
+        (opcionales ? campos.some(presente) : campos.every(presente)));
+    if (!cargada) return null;
+    var valores = {};
+    for (var i = 0; i < campos.length; i++) {
+        var el = buscar(doc, campos[i][1]);
+        if (!el && opcionales) { valores[campos[i][0]] = ''; continue; }
+        if (!el) return {error: 'faltante', campo: campos[i][1][1]};
+        valores[campos[i][0]] = (el.innerText || el.textContent || '').trim();
+    }
+    return {valores: valores};
+}
+"""
+
+JS_EXTRAER_CAMPOS = """
+var espera = arguments[0], campos = arguments[1], frame = arguments[2],
+    timeoutMs = arguments[3], opcionales = arguments[4],
+    listo = arguments[arguments.length - 1];
+""" + _JS_REVISAR + """
+var inicio = Date.now();
+(function intentar() {
+    var resultado = revisar();
+    if (resultado) {
+        listo(resultado);
+    } else if (Date.now() - inicio > timeoutMs) {
+        listo({error: 'timeout'});
+    } else {
+        setTimeout(intentar, 100);
+    }
+})();
+"""
+
+# Una sola revisión, sin esperar: la usa el modo de pestañas
+JS_REVISAR_CAMPOS = """
+var espera = arguments[0], campos = arguments[1], frame = arguments[2],
+    opcionales = arguments[3];
+""" + _JS_REVISAR + """
+return revisar();
+"""
+
+
+def leer_campos(url, perfil, pool=None, sesion=None):
+    """
+    Devuelve {columna: texto} según el perfil. Con `sesion` se intenta
+    primero sin navegador y solo se abre Chrome si la página lo necesita.
+    """
+    campos = perfil['campos']
+
+    if sesion is not None and admite_http(perfil):
+        textos = leer_ids_http(
+            url, sesion, [loc[1] for loc in campos.values()], perfil['espera'][1])
+        if textos is not None:
+            faltantes = [loc[1] for loc in campos.values()
+                         if loc[1] not in textos]
+            if faltantes and not perfil.get('opcionales'):
+                raise NoSuchElementException(
+                    f"No se encontró {faltantes[0]} en {url}")
+            return {col: textos.get(loc[1], "") for col, loc in campos.items()}
+
+    if isinstance(pool, PestanasChrome):
+        resultado = pool.leer(url, perfil)
+    else:
+        driver = obtener_driver(pool)
+        try:
+            bloquear_recursos(driver, perfil.get('permitir', ()))
+            driver.get(url)
+
+            # Espera y lectura de todos los campos en una sola llamada al driver
+            resultado = driver.execute_async_script(
+                JS_EXTRAER_CAMPOS,
+                perfil.get('espera'),
+                [[col, list(loc)] for col, loc in campos.items()],
+                perfil.get('frame'),
+                perfil['timeout'] * 1000,
+                perfil.get('opcionales', False))
+        finally:
+            liberar_driver(driver, pool)
+
+    if resultado.get('error') == 'red':
+        raise WebDriverException(f"No se pudo abrir {url}")
+    if resultado.get('error') == 'timeout':
+        raise TimeoutException(f"La página de {url} no cargó a tiempo")
+    if resultado.get('error') == 'faltante':
+        raise NoSuchElementException(
+            f"No se encontró {resultado['campo']} en {url}")
+    return resultado['valores']
+
+# Redirección de IPs: {ip del Excel: "host:puerto"}. Sirve para apuntar los
+# colectores web a simulador_ews.py (menu.py --mapa-ips mapa_simulador.json)
+MAPA_IPS = {}
+
+
+def cargar_mapa_ips(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        MAPA_IPS.update(json.load(f))
+    print(f"Mapa de IPs: {len(MAPA_IPS)} redirecciones desde {ruta}")
+
+
+def destino(ip):
+    """Host (y puerto) al que se conecta realmente el colector web."""
+    return MAPA_IPS.get(ip, ip)
+
+
+def host_y_puerto(ip, puerto):
+    # Con redirección se usa el puerto del mapa en lugar de 80/443
+    host, _, propio = destino(ip).rpartition(":")
+    return (host, int(propio)) if host else (ip, puerto)
+
 # Función para formatear la IP
 
 
@@ -72,773 +656,1607 @@ def format_ip(ip):
     else:
         return ip
 
-# Función para configurar el ancho de las columnas
+# Limpieza de porcentajes leídos de las impresoras
 
 
-def get_column_widths(ws):
-    widths = {}
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter  # Get the column name
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(cell.value)
-            except:
-                pass
-        widths[column] = max_length + 2  # Adding a bit more space
-    return widths
+def clean_percentage(value: str) -> str:
+    try:
+        if isinstance(value, str):
+            value = value.replace('%', '').strip()
+        return f"{int(round(float(value)))}%"
+    except ValueError:
+        return ""
 
-# Funciones para preservar y aplicar fórmulas y formatos
 
+def clean_percentage_color(value: str) -> str:
+    try:
+        if isinstance(value, str):
+            value = value.replace('%', '').strip()
+        return f"{int(round(float(value)))}%"
+    except (ValueError, TypeError):
+        return "0%"
+
+
+# Perfiles de impresora. Cada hoja del Excel indica:
+#   fabricante: solo informativo
+#   motor:      "web" (HTTP/Selenium) o "snmp"
+#   frame:      frame al que hay que entrar antes de leer (o None)
+#   espera:     elemento que indica que la página cargó (o None)
+#   timeout:    segundos de espera de la página
+#   campos:     columna del Excel -> localizador del valor
+#   ok_si:      columnas que, con algún valor, dejan el Estado en 'OK'
+#   limpiar:    función que normaliza el porcentaje leído
+#   permitir:   recursos que el modo liviano no debe bloquear (opcional)
+#   intervalo:  segundos entre lecturas en el modo demonio (opcional)
+# Una familia nueva de impresoras es una entrada más en este diccionario.
+
+PERFIL_HP_EWS = {
+    'fabricante': 'HP',
+    'motor': 'web',
+    'frame': None,
+    'espera': ("id", "SupplyName0"),
+    'timeout': 10,
+    'limpiar': clean_percentage,
+}
+
+PERFIL_SAMSUNG_SWS = {
+    'fabricante': 'Samsung',
+    'motor': 'web',
+    'frame': ("id", "ruifw_MainFrm"),
+    'espera': None,
+    'timeout': 5,
+    'limpiar': clean_percentage,
+}
+
+PERFIL_SAMSUNG_CLX = {
+    'fabricante': 'Samsung CLX-6260',
+    'motor': 'web',
+    'frame': None,
+    'espera': ("css selector", ".x-grid3-row:nth-child(1) .x-column:nth-child(2)"),
+    'timeout': 10,
+    'limpiar': clean_percentage,
+    # La grilla ExtJS calcula su tamaño con la hoja de estilos
+    'permitir': ("*.css",),
+}
+
+
+def _xpath_samsung(fila, posicion=1):
+    xpath = f"//tr[@id='{fila}']/td[2]/table/tbody/tr/td/table/tbody/tr/td[2]"
+    return ("xpath", xpath if posicion == 1 else f"({xpath})[{posicion}]")
+
+
+def _css_clx(fila):
+    return ("css selector", f".x-grid3-row:nth-child({fila}) .x-column:nth-child(2)")
+
+
+PERFILES_POR_HOJA = {
+    'HP Admin': {
+        **PERFIL_HP_EWS,
+        'campos': {
+            'Toner Negro': ("id", "SupplyGauge0"),
+            'Kit Mant.': ("id", "SupplyGauge1"),
+            'Kit Alim.': ("id", "SupplyGauge2"),
+        },
+        'ok_si': ['Toner Negro', 'Kit Mant.', 'Kit Alim.'],
+    },
+    'HP Planta': {
+        **PERFIL_HP_EWS,
+        'campos': {
+            'Toner Negro': ("id", "SupplyGauge0"),
+        },
+        'ok_si': ['Toner Negro'],
+    },
+    'HP Planta - 2': {
+        **PERFIL_HP_EWS,
+        'campos': {
+            'Toner Negro': ("id", "SupplyGauge0"),
+            'Kit Alim.': ("id", "SupplyGauge1"),
+        },
+        'ok_si': ['Toner Negro', 'Kit Alim.'],
+    },
+    'Color Admin': {
+        **PERFIL_HP_EWS,
+        'campos': {
+            'Toner Negro': ("id", "SupplyGauge0"),
+            'Toner Cian': ("id", "SupplyGauge1"),
+            'Toner Magenta': ("id", "SupplyGauge2"),
+            'Toner Amarillo': ("id", "SupplyGauge3"),
+        },
+        'ok_si': ['Toner Negro'],
+        'limpiar': clean_percentage_color,
+    },
+    'Color Planta': {
+        **PERFIL_HP_EWS,
+        'campos': {
+            'Toner Amarillo': ("id", "SupplyGauge0"),
+            'Toner Magenta': ("id", "SupplyGauge1"),
+            'Toner Cian': ("id", "SupplyGauge2"),
+            'Toner Negro': ("id", "SupplyGauge3"),
+            'Kit Alim.': ("id", "SupplyGauge4"),
+        },
+        'ok_si': ['Toner Amarillo'],
+        'limpiar': clean_percentage_color,
+    },
+    'Impresoras a Color': {
+        **PERFIL_SAMSUNG_SWS,
+        'campos': {
+            'Toner Negro': _xpath_samsung(1),
+            'UI Negro': _xpath_samsung(1, 2),
+            'Toner Cian': _xpath_samsung(2),
+            'UI Cian': _xpath_samsung(2, 2),
+            'Toner Magenta': _xpath_samsung(3),
+            'UI Magenta': _xpath_samsung(3, 2),
+            'Toner Amarillo': _xpath_samsung(4),
+            'UI Amarillo': _xpath_samsung(4, 2),
+        },
+        'ok_si': ['Toner Negro', 'Toner Cian', 'Toner Magenta', 'Toner Amarillo'],
+    },
+    'Impresora CLX-6260': {
+        **PERFIL_SAMSUNG_CLX,
+        'campos': {
+            'Toner Negro': _css_clx(1),
+            'Toner Cian': _css_clx(2),
+            'Toner Magenta': _css_clx(3),
+            'Toner Amarillo': _css_clx(4),
+        },
+        'ok_si': ['Toner Negro', 'Toner Cian', 'Toner Magenta', 'Toner Amarillo'],
+    },
+}
+
+
+def fetch_impresora(ip, sheet_name, pool=None, sesion=None, perfil=None):
+    """Colector genérico: lee una impresora según el perfil de su hoja."""
+    perfil = perfil or PERFILES_POR_HOJA[sheet_name]
+    vacio = {col: "" for col in perfil['campos']}
+
+    url = f"http://{destino(ip)}" if ip else None
+    if not url:
+        return {"IP": ip, **vacio, 'Estado': '', 'Marca de Tiempo': ""}
+
+    print(f"Procesando URL: {url}")
 
-def preserve_formulas_and_formats(input_file):
-    wb = load_workbook(input_file, data_only=False)
-    formulas = {}
-    for sheet_name in wb.sheetnames:
-        ws = wb[sheet_name]
-        sheet_formulas = {cell.coordinate: cell.formula if cell.data_type ==
-                          'f' else cell.value for row in ws.iter_rows() for cell in row}
-        formulas[sheet_name] = sheet_formulas
-    return formulas
+    try:
+        valores = leer_campos(url, perfil, pool, sesion)
+        return {
+            "IP": ip,
+            **valores,
+            'Estado': 'OK' if any(valores[col] for col in perfil['ok_si']) else 'No disponible',
+            'Marca de Tiempo': marca_de_tiempo()
+        }
+    except NoSuchElementException:
+        return {"IP": ip, **vacio, 'Estado': 'No Disponible', 'Marca de Tiempo': marca_de_tiempo()}
+    except (TimeoutException, requests.exceptions.ReadTimeout):
+        # La impresora contestó pero no terminó a tiempo: '_timeout' le
+        # avisa al ControladorConcurrencia que baje el límite
+        return {"IP": ip, **vacio, 'Estado': 'No Disponible', 'Marca de Tiempo': marca_de_tiempo(),
+                '_timeout': True}
+    except (WebDriverException, requests.RequestException):
+        print(f"Timeout al intentar conectar con {url}")
+        return {"IP": ip, **vacio, 'Estado': 'Fuera de Red', 'Marca de Tiempo': marca_de_tiempo()}
+
+
+def procesar_hoja(file_path, output_file, sheet_name, pool=None, sesion=None, resultados=None, controlador=None):
+
+    if resultados is not None:
+        # Resultados ya obtenidos por el escaneo conjunto de la flota
+        results = resultados
+    else:
+        ips = leer_hojas(file_path, [sheet_name])[sheet_name]['IP']
+        ips = ips.astype(str).apply(format_ip)
+        colector = colector_de_hoja(sheet_name)
+        controlador = controlador or ControladorConcurrencia()
+        with ThreadPoolExecutor(max_workers=controlador.maximo) as executor:
+            # Cada IP una sola vez aunque esté repetida en la hoja
+            future_to_ip = {executor.submit(
+                controlador.ejecutar, colector, ip, pool, sesion): ip for ip in dict.fromkeys(ips[ips.notna()])}
+            results = [future.result()
+                       for future in as_completed(future_to_ip)]
+        print(controlador.resumen())
 
-# Aplicar fórmulas y formatos preservados
+    # Solo se escriben las celdas que cambiaron: fórmulas, formatos y las
+    # demás hojas quedan como estaban
+    actualizar_libro(file_path, {sheet_name: results}, output_file)
 
 
-def apply_formulas_and_formats(output_file, formulas):
-    wb = load_workbook(output_file, data_only=False)
-    for sheet_name, sheet_formulas in formulas.items():
-        ws = wb[sheet_name]
-        for cell_coord, formula in sheet_formulas.items():
-            cell = ws[cell_coord]
-            if formula is not None:
-                if isinstance(formula, str) and formula.startswith('='):
-                    cell.formula = formula
-                else:
-                    cell.value = formula
-    wb.save(output_file)
+def procesar_impresoras_hp(file_path, output_file, pool=None, sesion=None, resultados=None):
+    procesar_hoja(file_path, output_file, 'HP Admin', pool, sesion, resultados)
+
 
+def procesar_impresoras_hp_grandes(file_path, output_file, pool=None, sesion=None, resultados=None):
+    procesar_hoja(file_path, output_file, 'HP Planta', pool, sesion, resultados)
 
-def procesar_impresoras_hp(file_path, output_file):
 
-    def clean_percentage(value: str) -> str:
-        try:
-            if isinstance(value, str):
-                value = value.replace('%', '').strip()
-            return f"{int(round(float(value)))}%"
-        except ValueError:
-            return ""
+def procesar_color_admin(file_path, output_file, pool=None, sesion=None, resultados=None):
+    procesar_hoja(file_path, output_file, 'Color Admin', pool, sesion, resultados)
+
+
+def procesar_planta(file_path, output_file, pool=None, sesion=None, resultados=None):
+    procesar_hoja(file_path, output_file, 'HP Planta - 2', pool, sesion, resultados)
+
 
-    def fetch_data_from_url(ip, options):
-        url = f"http://{ip}" if ip else None
-        if not url:
-            return {"IP": ip, "Toner Negro": "", "Kit Mant.": "", "Kit Alim.": "", 'Estado': '', 'Marca de Tiempo': ""}
+def procesar_color_planta(file_path, output_file, pool=None, sesion=None, resultados=None):
+    procesar_hoja(file_path, output_file, 'Color Planta', pool, sesion, resultados)
 
-        print(f"Procesando URL: {url}")
-        driver = configurar_driver(num_version)
+# Lectura por SNMP (Printer-MIB)
 
-        try:
+SNMP_COMUNIDAD = "public"
+SNMP_VERSION = "2c"  # "1" o "2c"
+SNMP_PUERTO = 161
 
-            driver.get(url)
+# Columnas de la tabla prtMarkerSuppliesTable (Printer-MIB, RFC 3805)
+OID_SUPPLIES_DESCRIPCION = "1.3.6.1.2.1.43.11.1.1.6"
+OID_SUPPLIES_CAPACIDAD = "1.3.6.1.2.1.43.11.1.1.8"
+OID_SUPPLIES_NIVEL = "1.3.6.1.2.1.43.11.1.1.9"
 
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.ID, "SupplyName0"))
-            )
+# Palabras de prtMarkerSuppliesDescription -> columna del Excel.
+# Los kits van primero para que "Maintenance Kit" no caiga en un tóner.
+PALABRAS_CONSUMIBLE = [
+    ("Kit Mant.", ("maintenance", "mantenimiento", "fuser", "fusor")),
+    ("Kit Alim.", ("feeder", "alimentador", "adf", "roller", "rodillo")),
+    ("Toner Cian", ("cyan", "cian")),
+    ("Toner Magenta", ("magenta",)),
+    ("Toner Amarillo", ("yellow", "amarillo")),
+    ("Toner Negro", ("black", "negro")),
+]
 
-            # Toner negro
-            toner_negro = driver.find_element(By.ID, "SupplyGauge0").text
-            # print(f"Tóner Negro: {toner_negro}")
 
-            # Kit de mantenimiento
-            kit_mantenimiento = driver.find_element(By.ID, "SupplyGauge1").text
-            # print(f"Kit de mantenimiento: {kit_mantenimiento}")
+def _ber_largo(largo):
+    if largo < 0x80:
+        return bytes([largo])
+    contenido = largo.to_bytes((largo.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(contenido)]) + contenido
 
-            # Kit alimentador documentos
-            kit_alimentador = driver.find_element(By.ID, "SupplyGauge2").text
-            # print(f"Kit alimentador documentos: {kit_alimentador}")
 
-            return {
-                "IP": ip,
-                "Toner Negro": toner_negro,
-                "Kit Mant.": kit_mantenimiento,
-                "Kit Alim.": kit_alimentador,
-                'Estado': 'OK' if toner_negro or kit_mantenimiento or kit_alimentador else 'No disponible',
-                'Marca de Tiempo': timestamp
-            }
-        except (NoSuchElementException):
-            return {"IP": ip, "Toner Negro": "", "Kit Mant.": "", "Kit Alim.": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except TimeoutException:
-            return {"IP": ip, "Toner Negro": "", "Kit Mant.": "", "Kit Alim.": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except WebDriverException:
-            print(f"Timeout al intentar conectar con {url}")
-            return {"IP": ip, "Toner Negro": "", "Kit Mant.": "", "Kit Alim.": "", 'Estado': 'Fuera de Red', 'Marca de Tiempo': timestamp}
-        finally:
-            driver.quit()
+def _ber(tag, contenido):
+    return bytes([tag]) + _ber_largo(len(contenido)) + contenido
 
-    # Leer las hojas del archivo Excel
-    sheets = pd.read_excel(file_path, sheet_name=None)
-    wb = load_workbook(file_path)
-    column_widths = {sheet_name: get_column_widths(
-        wb[sheet_name]) for sheet_name in wb.sheetnames}
 
-    # Procesar la hoja 'HP Admin'
-    df_original = sheets['HP Admin']
-    df_original['IP'] = df_original['IP'].astype(str).apply(format_ip)
-    df_filtered = df_original[df_original['IP'].notna()]
+def _ber_entero(valor):
+    largo = max(1, (valor.bit_length() + 8) // 8)
+    return _ber(0x02, valor.to_bytes(largo, "big", signed=True))
 
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_ip = {executor.submit(
-            fetch_data_from_url, ip, options): ip for ip in df_filtered['IP']}
-        results = [future.result() for future in as_completed(future_to_ip)]
+def _ber_oid(oid):
+    partes = [int(p) for p in oid.split(".")]
+    contenido = bytearray([partes[0] * 40 + partes[1]])
+    for parte in partes[2:]:
+        grupo = [parte & 0x7F]
+        parte >>= 7
+        while parte:
+            grupo.insert(0, 0x80 | (parte & 0x7F))
+            parte >>= 7
+        contenido.extend(grupo)
+    return _ber(0x06, bytes(contenido))
 
-    df_results = pd.DataFrame(results)
 
-    # Verificar que las columnas 'IP' existan antes de hacer el merge
-    if 'IP' not in df_original.columns or 'IP' not in df_results.columns:
-        raise KeyError("'IP' column is missing in one of the DataFrames.")
+def _ber_leer(datos, pos=0):
+    """Devuelve (tag, contenido, posición siguiente) del TLV en `pos`."""
+    tag = datos[pos]
+    largo = datos[pos + 1]
+    pos += 2
+    if largo & 0x80:
+        n = largo & 0x7F
+        largo = int.from_bytes(datos[pos:pos + n], "big")
+        pos += n
+    if pos + largo > len(datos):
+        raise ValueError("TLV truncado")
+    return tag, datos[pos:pos + largo], pos + largo
 
-    # Fusionar los resultados
-    df_updated = df_original.merge(
-        df_results, on='IP', how='left', suffixes=('', '_new')
-    )
 
-    # Restablecer columnas NaN
-    columns = ['Toner Negro', 'Kit Mant.',
-               'Kit Alim.', 'Estado', 'Marca de Tiempo']
-    df_updated[columns] = df_updated[columns].fillna('')
-
-    mask_ok = df_updated['Estado_new'] == 'OK'
-    columns = ['Toner Negro', 'Kit Mant.', 'Kit Alim.']
-    for col in columns:
-        df_updated[col] = df_updated[col].astype(str)
-        df_updated.loc[mask_ok, col] = df_updated.loc[mask_ok,
-                                                      f'{col}_new'].apply(clean_percentage)
-
-    df_updated['Estado'] = df_updated['Estado_new'].fillna(
-        df_updated['Estado'])
-    df_updated['Marca de Tiempo'] = df_updated['Marca de Tiempo_new'].fillna(
-        df_updated['Marca de Tiempo'])
-
-    columns_to_drop = [f'{col}_new' for col in columns +
-                       ['Estado', 'Marca de Tiempo']]
-    df_updated.drop(columns=[
-                    col for col in columns_to_drop if col in df_updated.columns], inplace=True)
-
-    # Guardar el DataFrame actualizado
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        df_updated.to_excel(
-            writer, sheet_name='HP Admin', index=False)
-        for sheet_name, df_sheet in sheets.items():
-            if sheet_name != 'HP Admin':
-                df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    # Aplicar fórmulas y formatos preservados
-    formulas = preserve_formulas_and_formats(file_path)
-    apply_formulas_and_formats(output_file, formulas)
-    # FUNCIONA
-    registrar_historico(file_path, df_updated)
-
-
-def procesar_impresoras_hp_grandes(file_path, output_file):
-
-    def clean_percentage(value: str) -> str:
-        try:
-            if isinstance(value, str):
-                value = value.replace('%', '').strip()
-            return f"{int(round(float(value)))}%"
-        except ValueError:
-            return ""
+def _ber_secuencia(contenido):
+    elementos = []
+    pos = 0
+    while pos < len(contenido):
+        tag, valor, pos = _ber_leer(contenido, pos)
+        elementos.append((tag, valor))
+    return elementos
 
-    def fetch_data_from_url(ip, options):
-        url = f"http://{ip}" if ip else None
-        if not url:
-            return {"IP": ip, "Toner Negro": "", 'Estado': '', 'Marca de Tiempo': ""}
 
-        print(f"Procesando URL: {url}")
-        driver = configurar_driver(num_version)
+def _ber_a_oid(contenido):
+    partes = [contenido[0] // 40, contenido[0] % 40]
+    valor = 0
+    for byte in contenido[1:]:
+        valor = (valor << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            partes.append(valor)
+            valor = 0
+    return ".".join(str(p) for p in partes)
 
-        try:
 
-            driver.get(url)
+def _ber_a_valor(tag, contenido):
+    if tag in (0x02, 0x41, 0x42, 0x43):  # INTEGER, Counter, Gauge, TimeTicks
+        return int.from_bytes(contenido, "big", signed=(tag == 0x02))
+    if tag == 0x04:
+        return contenido.decode("utf-8", errors="replace")
+    if tag == 0x06:
+        return _ber_a_oid(contenido)
+    # NULL, noSuchObject, noSuchInstance, endOfMibView
+    return None
+
+
+def snmp_consultar(ip, oids, comunidad=None, version=None, puerto=None, max_repeticiones=10, timeout=1.0, reintentos=1):
+    """
+    Envía un GetBulk (v2c) o GetNext (v1) por UDP y devuelve la lista de
+    (oid, valor) de la respuesta. Lanza socket.timeout si no hay respuesta.
+    """
+    version = version or SNMP_VERSION
+    id_peticion = random.randint(1, 2**31 - 1)
+    varbinds = b"".join(_ber(0x30, _ber_oid(oid) + _ber(0x05, b""))
+                        for oid in oids)
+    if version == "2c":
+        # GetBulkRequest: non-repeaters = 0, max-repetitions
+        pdu = _ber(0xA5, _ber_entero(id_peticion) + _ber_entero(0) +
+                   _ber_entero(max_repeticiones) + _ber(0x30, varbinds))
+    else:
+        pdu = _ber(0xA1, _ber_entero(id_peticion) + _ber_entero(0) +
+                   _ber_entero(0) + _ber(0x30, varbinds))
+    mensaje = _ber(0x30, _ber_entero(1 if version == "2c" else 0) +
+                   _ber(0x04, (comunidad or SNMP_COMUNIDAD).encode()) + pdu)
+
+    destino = (socket.gethostbyname(ip), puerto or SNMP_PUERTO)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for intento in range(reintentos + 1):
+            sock.sendto(mensaje, destino)
+            limite = time.monotonic() + timeout
+            while True:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                sock.settimeout(restante)
+                try:
+                    datos, remitente = sock.recvfrom(65535)
+                except socket.timeout:
+                    break
+                # Datagramas de otro equipo o mal formados se ignoran como si
+                # no hubieran llegado
+                if remitente[:2] != destino:
+                    continue
+                try:
+                    resultado = _snmp_respuesta(datos, id_peticion)
+                except (IndexError, ValueError):
+                    continue
+                if resultado is not None:
+                    return resultado
+        raise socket.timeout(f"Sin respuesta SNMP de {ip}")
 
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.ID, "SupplyName0"))
-            )
 
-            # Toner negro
-            toner_negro = driver.find_element(By.ID, "SupplyGauge0").text
-            # print(f"Tóner Negro: {toner_negro}")
+def _snmp_respuesta(datos, id_peticion):
+    """
+    Decodifica una respuesta SNMP. Devuelve None si es de otra petición y
+    lanza ValueError/IndexError si el paquete está mal formado.
+    """
+    _, cuerpo, _ = _ber_leer(datos)
+    _, _, (tag_pdu, contenido_pdu) = _ber_secuencia(cuerpo)
+    campos = _ber_secuencia(contenido_pdu)
+    if _ber_a_valor(*campos[0]) != id_peticion:
+        return None
+    if _ber_a_valor(*campos[1]) != 0:
+        # v1 responde noSuchName al pasar el final de la MIB
+        return []
+    resultado = []
+    for _, varbind in _ber_secuencia(campos[3][1]):
+        (_, oid), (tag, valor) = _ber_secuencia(varbind)
+        resultado.append((_ber_a_oid(oid), _ber_a_valor(tag, valor)))
+    return resultado
+
+
+def snmp_recorrer_columnas(ip, columnas, **kwargs):
+    """
+    Recorre varias columnas de una tabla SNMP en paralelo con peticiones
+    bulk y devuelve {columna: {índice: valor}}.
+    """
+    valores = {columna: {} for columna in columnas}
+    cursores = {columna: columna for columna in columnas}
+
+    while cursores:
+        pendientes = list(cursores)
+        anteriores = dict(cursores)
+        respuesta = snmp_consultar(
+            ip, [cursores[c] for c in pendientes], **kwargs)
+        if not respuesta:
+            break
 
-            return {
-                "IP": ip,
-                "Toner Negro": toner_negro,
-                'Estado': 'OK' if toner_negro else 'No disponible',
-                'Marca de Tiempo': timestamp
-            }
-        except (NoSuchElementException):
-            return {"IP": ip, "Toner Negro": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except TimeoutException:
-            return {"IP": ip, "Toner Negro": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except WebDriverException:
-            print(f"Timeout al intentar conectar con {url}")
-            return {"IP": ip, "Toner Negro": "", 'Estado': 'Fuera de Red', 'Marca de Tiempo': timestamp}
-        finally:
-            driver.quit()
+        # Los varbinds vienen intercalados: fila 0 de cada columna, fila 1...
+        for i, (oid, valor) in enumerate(respuesta):
+            columna = pendientes[i % len(pendientes)]
+            if columna not in cursores:
+                continue
+            if valor is None or not oid.startswith(columna + "."):
+                del cursores[columna]
+                continue
+            valores[columna][oid[len(columna) + 1:]] = valor
+            cursores[columna] = oid
 
-    # Leer las hojas del archivo Excel
-    sheets = pd.read_excel(file_path, sheet_name=None)
-    wb = load_workbook(file_path)
-    column_widths = {sheet_name: get_column_widths(
-        wb[sheet_name]) for sheet_name in wb.sheetnames}
+        # Un agente que no avanza en alguna columna también la cierra
+        for columna in pendientes:
+            if cursores.get(columna) == anteriores[columna]:
+                del cursores[columna]
 
-    # Procesar la hoja 'HP Planta'
-    df_original = sheets['HP Planta']
-    df_original['IP'] = df_original['IP'].astype(str).apply(format_ip)
-    df_filtered = df_original[df_original['IP'].notna()]
+    return valores
 
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_ip = {executor.submit(
-            fetch_data_from_url, ip, options): ip for ip in df_filtered['IP']}
-        results = [future.result() for future in as_completed(future_to_ip)]
+def columna_de_consumible(descripcion):
+    descripcion = descripcion.lower()
+    for columna, palabras in PALABRAS_CONSUMIBLE:
+        if any(palabra in descripcion for palabra in palabras):
+            return columna
+    return None
 
-    df_results = pd.DataFrame(results)
 
-    # Verificar que las columnas 'IP' existan antes de hacer el merge
-    if 'IP' not in df_original.columns or 'IP' not in df_results.columns:
-        raise KeyError("'IP' column is missing in one of the DataFrames.")
+def porcentaje_snmp(nivel, capacidad):
+    # -2 = desconocido, -3 = queda algo pero no se sabe cuánto
+    if not isinstance(nivel, int) or nivel < 0:
+        return ""
+    if not isinstance(capacidad, int) or capacidad <= 0:
+        return f"{nivel}%" if nivel <= 100 else ""
+    return f"{int(round(nivel * 100 / capacidad))}%"
 
-    # Fusionar los resultados
-    df_updated = df_original.merge(
-        df_results, on='IP', how='left', suffixes=('', '_new')
-    )
 
-    # Restablecer columnas NaN
-    columns = ['Toner Negro', 'Estado', 'Marca de Tiempo']
-    df_updated[columns] = df_updated[columns].fillna('')
-
-    mask_ok = df_updated['Estado_new'] == 'OK'
-    columns = ['Toner Negro']
-    for col in columns:
-        df_updated[col] = df_updated[col].astype(str)
-        df_updated.loc[mask_ok, col] = df_updated.loc[mask_ok,
-                                                      f'{col}_new'].apply(clean_percentage)
-
-    df_updated['Estado'] = df_updated['Estado_new'].fillna(
-        df_updated['Estado'])
-    df_updated['Marca de Tiempo'] = df_updated['Marca de Tiempo_new'].fillna(
-        df_updated['Marca de Tiempo'])
-
-    columns_to_drop = [f'{col}_new' for col in columns +
-                       ['Estado', 'Marca de Tiempo']]
-    df_updated.drop(columns=[
-                    col for col in columns_to_drop if col in df_updated.columns], inplace=True)
-
-    # Guardar el DataFrame actualizado
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        df_updated.to_excel(
-            writer, sheet_name='HP Planta', index=False)
-        for sheet_name, df_sheet in sheets.items():
-            if sheet_name != 'HP Planta':
-                df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    # Aplicar fórmulas y formatos preservados
-    formulas = preserve_formulas_and_formats(file_path)
-    apply_formulas_and_formats(output_file, formulas)
-    # REVISANDO
-    registrar_historico(file_path, df_updated)
-
-
-def procesar_color_admin(file_path, output_file):
-
-    def clean_percentage(value: str) -> str:
-        try:
-            if isinstance(value, str):
-                value = value.replace('%', '').strip()
-            return f"{int(round(float(value)))}%"
-        except (ValueError, TypeError):
-            return "0%"
+def fetch_snmp(ip, columnas, **kwargs):
+    """
+    Lee los consumibles por SNMP y los entrega con las mismas columnas que
+    el colector web de la hoja.
+    """
+    vacio = {columna: "" for columna in columnas}
+    if not ip:
+        return {"IP": ip, **vacio, 'Estado': '', 'Marca de Tiempo': ""}
 
-    def fetch_data_from_url(ip, options):
-        url = f"http://{ip}" if ip else None
-        if not url:
-            return {"IP": ip, "Toner Negro": "", "Toner Cian": "", "Toner Magenta": "", "Toner Amarillo": "",  'Estado': '', 'Marca de Tiempo': ""}
+    print(f"Consultando SNMP: {ip}")
+    host, puerto = host_y_puerto(ip, kwargs.pop('puerto', None) or SNMP_PUERTO)
+    try:
+        tabla = snmp_recorrer_columnas(
+            host, [OID_SUPPLIES_DESCRIPCION, OID_SUPPLIES_CAPACIDAD, OID_SUPPLIES_NIVEL],
+            puerto=puerto, **kwargs)
+    except OSError:
+        print(f"Timeout al intentar conectar con {ip} por SNMP")
+        return {"IP": ip, **vacio, 'Estado': 'Fuera de Red', 'Marca de Tiempo': marca_de_tiempo()}
+
+    niveles = dict(vacio)
+    for indice, descripcion in tabla[OID_SUPPLIES_DESCRIPCION].items():
+        columna = columna_de_consumible(str(descripcion))
+        if columna in niveles and not niveles[columna]:
+            niveles[columna] = porcentaje_snmp(
+                tabla[OID_SUPPLIES_NIVEL].get(indice),
+                tabla[OID_SUPPLIES_CAPACIDAD].get(indice))
+
+    return {
+        "IP": ip,
+        **niveles,
+        'Estado': 'OK' if any(niveles.values()) else 'No Disponible',
+        'Marca de Tiempo': marca_de_tiempo()
+    }
+
+
+def columnas_de_hoja(sheet_name):
+    """Columnas de consumibles que actualiza el colector de la hoja."""
+    return list(PERFILES_POR_HOJA[sheet_name]['campos'])
+
+
+def colector_de_hoja(sheet_name, perfil=None):
+    """Función (ip, pool, sesion) que consulta una impresora de la hoja."""
+    perfil = perfil or PERFILES_POR_HOJA[sheet_name]
+    if perfil['motor'] == "snmp":
+        columnas = list(perfil['campos'])
+
+        def colector(ip, pool=None, sesion=None):
+            return fetch_snmp(ip, columnas)
+    else:
+        def colector(ip, pool=None, sesion=None):
+            return fetch_impresora(ip, sheet_name, pool, sesion, perfil)
+    return colector
 
-        print(f"Procesando URL: {url}")
-        driver = configurar_driver(num_version)
 
-        try:
+# Una consulta por impresora aunque aparezca en varias hojas
 
-            driver.get(url)
+def clave_de_lectura(sheet_name):
+    """Hojas con la misma clave leen la impresora de la misma forma."""
+    # campos y ok_si se combinan; limpiar se aplica al escribir cada hoja
+    return repr(sorted((campo, valor) for campo, valor in PERFILES_POR_HOJA[sheet_name].items()
+                       if campo not in ('fabricante', 'campos', 'ok_si', 'limpiar', 'intervalo')))
 
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.ID, "SupplyName0"))
-            )
 
-            # Toner negro
-            toner_negro = driver.find_element(By.ID, "SupplyGauge0").text
-            toner_cian = driver.find_element(By.ID, "SupplyGauge1").text
-            toner_magenta = driver.find_element(By.ID, "SupplyGauge2").text
-            toner_amarillo = driver.find_element(By.ID, "SupplyGauge3").text
+def agrupar_lecturas(ips_por_hoja):
+    """
+    Índice de impresoras únicas: [(ip, hojas)] con cada IP una sola vez
+    para las hojas que se pueden leer juntas (misma clave y sin columnas
+    con localizadores distintos).
+    """
+    grupos = {}
+    for sheet_name, ips in ips_por_hoja.items():
+        campos = PERFILES_POR_HOJA[sheet_name]['campos']
+        for ip in dict.fromkeys(ips):
+            particiones = grupos.setdefault((clave_de_lectura(sheet_name), ip), [])
+            for hojas in particiones:
+                if all(PERFILES_POR_HOJA[otra]['campos'].get(col, loc) == loc
+                       for otra in hojas for col, loc in campos.items()):
+                    hojas.append(sheet_name)
+                    break
+            else:
+                particiones.append([sheet_name])
+    return [(ip, hojas) for (_, ip), particiones in grupos.items() for hojas in particiones]
+
+
+def perfil_combinado(hojas):
+    """
+    Perfil de la primera hoja con los campos y ok_si de todas. Los campos
+    son opcionales: lo que falta en la página vale '' y cada hoja decide su
+    Estado con sus propias columnas en resultado_para_hoja.
+    """
+    perfil = dict(PERFILES_POR_HOJA[hojas[0]])
+    if len(hojas) > 1:
+        perfil['opcionales'] = True
+        perfil['campos'] = {col: loc for sheet_name in hojas
+                            for col, loc in PERFILES_POR_HOJA[sheet_name]['campos'].items()}
+        perfil['ok_si'] = list(dict.fromkeys(
+            col for sheet_name in hojas for col in PERFILES_POR_HOJA[sheet_name].get('ok_si', [])))
+    return perfil
+
+
+def resultado_para_hoja(resultado, sheet_name):
+    """Recorta un resultado combinado a las columnas de la hoja y rehace su Estado."""
+    perfil = PERFILES_POR_HOJA[sheet_name]
+    propio = {"IP": resultado['IP'],
+              **{col: resultado.get(col, "") for col in perfil['campos']},
+              'Estado': resultado['Estado'],
+              'Marca de Tiempo': resultado['Marca de Tiempo']}
+    if perfil['motor'] == "snmp":
+        if resultado['Estado'] == 'OK' and not any(propio[col] for col in perfil['campos']):
+            propio['Estado'] = 'No Disponible'
+    elif resultado['Estado'] in ('OK', 'No disponible'):
+        propio['Estado'] = 'OK' if any(propio[col] for col in perfil['ok_si']) else 'No disponible'
+    return propio
+
+
+# Control adaptativo de la concurrencia de consultas
+
+
+class ControladorConcurrencia:
+    """
+    Límite de consultas simultáneas con ajuste AIMD: crece en una consulta
+    por cada "vuelta" completa de respuestas (1/límite por éxito) mientras la
+    latencia p95 y el uso de CPU estén bajo los objetivos, y se reduce a la
+    mitad ante timeouts o presión de memoria. Las impresoras apagadas o
+    fuera de red no cuentan como congestión.
+    """
 
-            '''
-            print(f"Tóner Negro: {toner_negro}")
-            print(f"Tóner Cian: {toner_cian}")
-            print(f"Tóner Magenta: {toner_magenta}")
-            print(f"Tóner Amarillo: {toner_amarillo}")
-            '''
+    def __init__(self, inicial=5, minimo=1, maximo=20, p95_objetivo=15.0,
+                 cpu_maxima=85.0, memoria_maxima=85.0, ventana=20, espera_baja=15.0):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.p95_objetivo = p95_objetivo
+        # Segundos mínimos entre dos bajas del límite
+        self.espera_baja = espera_baja
+        self.cpu_maxima = cpu_maxima
+        self.memoria_maxima = memoria_maxima
+        self._limite = inicial
+        self._aumento = 0.0
+        self._en_curso = 0
+        self._latencias = deque(maxlen=ventana)
+        self._terminadas = deque()
+        self._ultima_baja = 0.0
+        self._inicio = time.monotonic()
+        self._cond = threading.Condition()
+        # Espera del escaneo asyncio: liberar() la despierta desde cualquier hilo
+        self._loop = None
+        self._cond_async = None
+
+    @property
+    def limite(self):
+        return self._limite
+
+    def throughput(self, segundos=60):
+        """Consultas terminadas por segundo en la ventana reciente."""
+        ahora = time.monotonic()
+        # Al arrancar la ventana todavía no se llenó: se divide por el tiempo
+        # realmente transcurrido
+        transcurrido = min(segundos, ahora - self._inicio)
+        if transcurrido <= 0:
+            return 0.0
+        with self._cond:
+            recientes = [t for t in self._terminadas if ahora - t <= segundos]
+        return len(recientes) / transcurrido
+
+    def p95(self):
+        with self._cond:
+            latencias = sorted(self._latencias)
+        if not latencias:
+            return None
+        return latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))]
+
+    def intentar_adquirir(self):
+        with self._cond:
+            if self._en_curso >= self._limite:
+                return False
+            self._en_curso += 1
+            return True
+
+    def adquirir(self):
+        with self._cond:
+            while self._en_curso >= self._limite:
+                self._cond.wait()
+            self._en_curso += 1
+
+    async def adquirir_async(self):
+        """Como adquirir(), pero espera en el event loop sin bloquearlo."""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._loop is not loop:
+                self._loop = loop
+                self._cond_async = asyncio.Condition()
+            cond_async = self._cond_async
+        async with cond_async:
+            await cond_async.wait_for(self.intentar_adquirir)
+
+    async def _despertar(self, cond_async):
+        async with cond_async:
+            cond_async.notify_all()
+
+    def liberar(self, latencia, timeout=False):
+        ahora = time.monotonic()
+        with self._cond:
+            self._en_curso -= 1
+            self._latencias.append(latencia)
+            self._terminadas.append(ahora)
+            while self._terminadas and ahora - self._terminadas[0] > 300:
+                self._terminadas.popleft()
+            self._ajustar(ahora, timeout)
+            self._cond.notify_all()
+            loop, cond_async = self._loop, self._cond_async
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(
+                    lambda: loop.create_task(self._despertar(cond_async)))
+            except RuntimeError:
+                # El loop del escaneo ya terminó
+                pass
 
-            return {
-                "IP": ip,
-                "Toner Negro": toner_negro,
-                "Toner Cian": toner_cian,
-                "Toner Magenta": toner_magenta,
-                "Toner Amarillo": toner_amarillo,
-                'Estado': 'OK' if toner_negro else 'No disponible',
-                'Marca de Tiempo': timestamp
-            }
-        except (NoSuchElementException):
-            return {"IP": ip, "Toner Negro": "", "Toner Cian": "", "Toner Magenta": "", "Toner Amarillo": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except TimeoutException:
-            return {"IP": ip, "Toner Negro": "", "Toner Cian": "", "Toner Magenta": "", "Toner Amarillo": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except WebDriverException:
-            print(f"Timeout al intentar conectar con {url}")
-            return {"IP": ip, "Toner Negro": "", "Toner Cian": "", "Toner Magenta": "", "Toner Amarillo": "", 'Estado': 'Fuera de Red', 'Marca de Tiempo': timestamp}
+    def _ajustar(self, ahora, timeout):
+        cpu, memoria = _uso_del_equipo()
+        if timeout or memoria > self.memoria_maxima:
+            # Una sola baja por "vuelta" para no desplomar el límite por un
+            # grupo de impresoras caídas que fallan juntas
+            if ahora - self._ultima_baja >= self.espera_baja:
+                self._limite = max(self.minimo, self._limite // 2)
+                self._aumento = 0.0
+                self._ultima_baja = ahora
+            return
+
+        latencias = sorted(self._latencias)
+        if len(latencias) < 5:
+            return
+        p95 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))]
+        if p95 <= self.p95_objetivo and cpu <= self.cpu_maxima:
+            self._aumento += 1 / self._limite
+            if self._aumento >= 1:
+                self._aumento -= 1
+                self._limite = min(self.maximo, self._limite + 1)
+
+    def ejecutar(self, funcion, *args):
+        """Corre `funcion` respetando el límite (para ThreadPoolExecutor)."""
+        self.adquirir()
+        inicio = time.monotonic()
+        timeout = False
+        try:
+            resultado = funcion(*args)
+            # Los colectores convierten los timeouts en un resultado marcado
+            timeout = fue_timeout(resultado)
+            return resultado
+        except (TimeoutError, TimeoutException):
+            timeout = True
+            raise
         finally:
-            driver.quit()
+            self.liberar(time.monotonic() - inicio, timeout)
 
-    # Leer las hojas del archivo Excel
-    sheets = pd.read_excel(file_path, sheet_name=None)
-    wb = load_workbook(file_path)
-    column_widths = {sheet_name: get_column_widths(
-        wb[sheet_name]) for sheet_name in wb.sheetnames}
+    def resumen(self):
+        p95 = self.p95()
+        p95 = f"{p95:.1f} s" if p95 is not None else "-"
+        return (f"Concurrencia: {self._limite} | p95: {p95} | "
+                f"{self.throughput():.2f} impresoras/s")
 
-    # Procesar la hoja 'Color Admin'
-    df_original = sheets['Color Admin']
-    df_original['IP'] = df_original['IP'].astype(str).apply(format_ip)
-    df_filtered = df_original[df_original['IP'].notna()]
 
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
+def _uso_del_equipo():
+    # psutil es opcional: sin él solo se usa la latencia para ajustar
+    if psutil is None:
+        return 0.0, 0.0
+    return psutil.cpu_percent(interval=None), psutil.virtual_memory().percent
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_ip = {executor.submit(
-            fetch_data_from_url, ip, options): ip for ip in df_filtered['IP']}
-        results = [future.result() for future in as_completed(future_to_ip)]
 
-    df_results = pd.DataFrame(results)
+def es_fallo(resultado):
+    return resultado.get('Estado') in ('No Disponible', 'Fuera de Red')
 
-    # Verificar que las columnas 'IP' existan antes de hacer el merge
-    if 'IP' not in df_original.columns or 'IP' not in df_results.columns:
-        raise KeyError("'IP' column is missing in one of the DataFrames.")
 
-    # Fusionar los resultados
-    df_updated = df_original.merge(
-        df_results, on='IP', how='left', suffixes=('', '_new')
-    )
+def fue_timeout(resultado):
+    """Si la impresora respondió pero la página no terminó a tiempo (congestión)."""
+    return isinstance(resultado, dict) and bool(resultado.get('_timeout'))
 
-    # Restablecer columnas NaN
-    columns = ['Toner Negro', 'Toner Cian', 'Toner Magenta',
-               'Toner Amarillo', 'Estado', 'Marca de Tiempo']
-    df_updated[columns] = df_updated[columns].fillna('')
-
-    mask_ok = df_updated['Estado_new'] == 'OK'
-    columns = ['Toner Negro', 'Toner Cian', 'Toner Magenta', 'Toner Amarillo']
-
-    # 🔹 Crear las columnas *_new si no existen
-    for col in columns:
-        new_col = f"{col}_new"
-        if new_col not in df_updated.columns:
-            df_updated[new_col] = None
-
-    # 🔹 Actualizar valores
-    for col in columns:
-        df_updated[col] = df_updated[col].astype(str)
-        df_updated.loc[mask_ok, col] = df_updated.loc[mask_ok,
-                                                      f'{col}_new'].apply(clean_percentage)
-
-    df_updated['Estado'] = df_updated['Estado_new'].fillna(
-        df_updated['Estado'])
-    df_updated['Marca de Tiempo'] = df_updated['Marca de Tiempo_new'].fillna(
-        df_updated['Marca de Tiempo'])
-
-    columns_to_drop = [f'{col}_new' for col in columns +
-                       ['Estado', 'Marca de Tiempo']]
-    df_updated.drop(columns=[
-                    col for col in columns_to_drop if col in df_updated.columns], inplace=True)
-
-    # Guardar el DataFrame actualizado
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        df_updated.to_excel(
-            writer, sheet_name='Color Admin', index=False)
-        for sheet_name, df_sheet in sheets.items():
-            if sheet_name != 'Color Admin':
-                df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    # Aplicar fórmulas y formatos preservados
-    formulas = preserve_formulas_and_formats(file_path)
-    apply_formulas_and_formats(output_file, formulas)
-    registrar_historico(output_file, df_updated)
-
-
-def procesar_planta(file_path, output_file):
-
-    def clean_percentage(value: str) -> str:
-        try:
-            if isinstance(value, str):
-                value = value.replace('%', '').strip()
-            return f"{int(round(float(value)))}%"
-        except ValueError:
-            return ""
 
-    def fetch_data_from_url(ip, options):
-        url = f"http://{ip}" if ip else None
-        if not url:
-            return {"IP": ip, "Toner Negro": "", "Kit Alim.": "", 'Estado': '', 'Marca de Tiempo': ""}
+# Caché de impresoras caídas con reintentos espaciados
+
+ARCHIVO_FALLOS = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "impresoras_fallos.json")
+
 
-        print(f"Procesando URL: {url}")
-        driver = configurar_driver(num_version)
+class CacheFallos:
+    """
+    Recuerda por IP las impresoras que no respondieron. Cada fallo seguido
+    duplica la espera antes de volver a consultarlas (con algo de azar para
+    que no vuelvan todas en la misma pasada); mientras tanto solo se les
+    hace un sondeo TCP barato y, si sigue sin contestar, se omiten.
+    """
 
+    def __init__(self, archivo=ARCHIVO_FALLOS, espera_base=15 * 60, espera_maxima=24 * 60 * 60):
+        self.archivo = archivo
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self._lock = threading.Lock()
         try:
+            with open(archivo, encoding="utf-8") as f:
+                self._fallos = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._fallos = {}
+
+    def guardar(self):
+        with self._lock:
+            with open(self.archivo, "w", encoding="utf-8") as f:
+                json.dump(self._fallos, f, indent=2)
+
+    def desde(self, ip):
+        """Marca de tiempo del primer fallo seguido, o None si responde."""
+        fallo = self._fallos.get(ip)
+        return fallo['desde'] if fallo else None
+
+    def en_espera(self, ip):
+        fallo = self._fallos.get(ip)
+        return fallo is not None and time.time() < fallo['reintentar']
+
+    def registrar(self, resultado):
+        ip = resultado.get('IP')
+        if not ip:
+            return
+        with self._lock:
+            if not es_fallo(resultado):
+                self._fallos.pop(ip, None)
+                return
+            fallo = self._fallos.get(ip) or {
+                'fallos': 0, 'desde': resultado['Marca de Tiempo']}
+            fallo['fallos'] += 1
+            fallo['estado'] = resultado['Estado']
+            espera = min(self.espera_maxima,
+                         self.espera_base * 2 ** (fallo['fallos'] - 1))
+            fallo['reintentar'] = time.time() + espera * random.uniform(0.5, 1.0)
+            self._fallos[ip] = fallo
+
+    def omitido(self, ip, columnas):
+        """
+        Resultado para una IP omitida: sin valores ni marca de tiempo, así
+        quedan los últimos y no se registra una lectura que no ocurrió.
+        """
+        return {"IP": ip, **{col: "" for col in columnas},
+                'Estado': self._fallos[ip]['estado'], 'Marca de Tiempo': None}
+
+
+def sondear(ip, motor="web", timeout=0.5):
+    """Comprobación barata de que la impresora volvió a la red."""
+    try:
+        if motor == "snmp":
+            host, puerto = host_y_puerto(ip, SNMP_PUERTO)
+            snmp_consultar(host, [OID_SUPPLIES_DESCRIPCION], puerto=puerto,
+                           max_repeticiones=1, timeout=timeout, reintentos=0)
+        else:
+            socket.create_connection(host_y_puerto(ip, 80), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
 
-            driver.get(url)
 
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.ID, "SupplyName0"))
-            )
+# Caché de libros leídos: el Excel está en una unidad de red y en una misma
+# sesión se interpretaba entero varias veces. La clave es ruta + tamaño +
+# fecha de modificación: mientras el archivo no cambie no se vuelve a leer
 
-            # Toner negro
-            toner_negro = driver.find_element(By.ID, "SupplyGauge0").text
-            # print(f"Tóner Negro: {toner_negro}")
+CARPETA_CACHE_LIBROS = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "cache_libros")
+_HOJAS_EN_MEMORIA = {}
+_LIBROS_EN_MEMORIA = {}
 
-            # Kit de mantenimiento
-            kit_alimentador = driver.find_element(By.ID, "SupplyGauge1").text
-            # print(f"Kit de mantenimiento: {kit_mantenimiento}")
 
-            return {
-                "IP": ip,
-                "Toner Negro": toner_negro,
-                "Kit Alim.": kit_alimentador,
-                'Estado': 'OK' if toner_negro or kit_alimentador else 'No disponible',
-                'Marca de Tiempo': timestamp
-            }
-        except (NoSuchElementException):
-            return {"IP": ip, "Toner Negro": "", "Kit Alim.": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except TimeoutException:
-            return {"IP": ip, "Toner Negro": "", "Kit Alim.": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except WebDriverException:
-            print(f"Timeout al intentar conectar con {url}")
-            return {"IP": ip, "Toner Negro": "", "Kit Alim.": "", 'Estado': 'Fuera de Red', 'Marca de Tiempo': timestamp}
-        finally:
-            driver.quit()
+def firma_archivo(ruta):
+    estado = os.stat(ruta)
+    return (os.path.abspath(ruta), estado.st_size, estado.st_mtime_ns)
 
-    # Leer las hojas del archivo Excel
-    sheets = pd.read_excel(file_path, sheet_name=None)
-    wb = load_workbook(file_path)
-    column_widths = {sheet_name: get_column_widths(
-        wb[sheet_name]) for sheet_name in wb.sheetnames}
 
-    # Procesar la hoja 'HP Planta - 2'
-    df_original = sheets['HP Planta - 2']
-    df_original['IP'] = df_original['IP'].astype(str).apply(format_ip)
-    df_filtered = df_original[df_original['IP'].notna()]
+def _ruta_pickle(ruta):
+    import hashlib
 
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
+    nombre = hashlib.sha1(os.path.abspath(ruta).encode("utf-8")).hexdigest()
+    return os.path.join(CARPETA_CACHE_LIBROS, f"{nombre}.pkl")
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_ip = {executor.submit(
-            fetch_data_from_url, ip, options): ip for ip in df_filtered['IP']}
-        results = [future.result() for future in as_completed(future_to_ip)]
 
-    df_results = pd.DataFrame(results)
+def _leer_pickle(ruta, firma):
+    import pickle
 
-    # Verificar que las columnas 'IP' existan antes de hacer el merge
-    if 'IP' not in df_original.columns or 'IP' not in df_results.columns:
-        raise KeyError("'IP' column is missing in one of the DataFrames.")
+    try:
+        with open(_ruta_pickle(ruta), "rb") as f:
+            guardado = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+        # Sin caché, o de otra versión de pandas: se vuelve a leer el Excel
+        return None
+    return guardado if guardado.get('firma') == firma else None
 
-    # Fusionar los resultados
-    df_updated = df_original.merge(
-        df_results, on='IP', how='left', suffixes=('', '_new')
-    )
 
-    # Restablecer columnas NaN
-    columns = ['Toner Negro', 'Kit Alim.', 'Estado', 'Marca de Tiempo']
-    df_updated[columns] = df_updated[columns].fillna('')
-
-    mask_ok = df_updated['Estado_new'] == 'OK'
-    columns = ['Toner Negro', 'Kit Alim.']
-    for col in columns:
-        df_updated[col] = df_updated[col].astype(str)
-        df_updated.loc[mask_ok, col] = df_updated.loc[mask_ok,
-                                                      f'{col}_new'].apply(clean_percentage)
-
-    df_updated['Estado'] = df_updated['Estado_new'].fillna(
-        df_updated['Estado'])
-    df_updated['Marca de Tiempo'] = df_updated['Marca de Tiempo_new'].fillna(
-        df_updated['Marca de Tiempo'])
-
-    columns_to_drop = [f'{col}_new' for col in columns +
-                       ['Estado', 'Marca de Tiempo']]
-    df_updated.drop(columns=[
-                    col for col in columns_to_drop if col in df_updated.columns], inplace=True)
-
-    # Guardar el DataFrame actualizado
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        df_updated.to_excel(
-            writer, sheet_name='HP Planta - 2', index=False)
-        for sheet_name, df_sheet in sheets.items():
-            if sheet_name != 'HP Planta - 2':
-                df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    # Aplicar fórmulas y formatos preservados
-    formulas = preserve_formulas_and_formats(file_path)
-    apply_formulas_and_formats(output_file, formulas)
-    # NO FUNCIONA
-    registrar_historico(output_file, df_updated)
-
-
-def procesar_color_planta(file_path, output_file):
-
-    def clean_percentage(value: str) -> str:
-        try:
-            if isinstance(value, str):
-                value = value.replace('%', '').strip()
-            return f"{int(round(float(value)))}%"
-        except (ValueError, TypeError):
-            return "0%"
+def _escribir_pickle(ruta, guardado):
+    import pickle
 
-    def fetch_data_from_url(ip, options):
-        url = f"http://{ip}" if ip else None
-        if not url:
-            return {"IP": ip, "Toner Amarillo": "", "Toner Magenta": "", "Toner Cian": "", "Toner Negro": "", "Kit Alim.": "", 'Estado': '', 'Marca de Tiempo': ""}
+    destino = _ruta_pickle(ruta)
+    try:
+        os.makedirs(CARPETA_CACHE_LIBROS, exist_ok=True)
+        with open(destino + ".tmp", "wb") as f:
+            pickle.dump(guardado, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(destino + ".tmp", destino)
+    except OSError as e:
+        print(f"No se pudo guardar la caché de {ruta}: {e}")
 
-        print(f"Procesando URL: {url}")
-        driver = configurar_driver(num_version)
 
-        try:
+def leer_hojas(file_path, hojas=None):
+    """
+    {hoja: DataFrame} como pd.read_excel(sheet_name=None), pero cada hoja
+    se interpreta una sola vez mientras el archivo no cambie: se guarda en
+    memoria y en un pickle local que sirve también a la próxima ejecución.
+    `hojas` limita las que se leen (las que no están en el libro se omiten).
+    Devuelve copias, así que se pueden modificar.
+    """
+    firma = firma_archivo(file_path)
+    guardado = _HOJAS_EN_MEMORIA.get(firma[0])
+    if guardado is None or guardado['firma'] != firma:
+        guardado = _leer_pickle(file_path, firma) or {'firma': firma, 'nombres': None, 'hojas': {}}
 
-            driver.get(url)
+    def pedidas():
+        return [nombre for nombre in guardado['nombres'] if hojas is None or nombre in hojas]
 
-            # Esperar a que cargue el primer consumible
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.ID, "SupplyName0"))
-            )
-
-            toner_amarillo = driver.find_element(By.ID, "SupplyGauge0").text
-            toner_magenta = driver.find_element(By.ID, "SupplyGauge1").text
-            toner_cian = driver.find_element(By.ID, "SupplyGauge2").text
-            toner_negro = driver.find_element(By.ID, "SupplyGauge3").text
-            kit_alimentador = driver.find_element(By.ID, "SupplyGauge4").text
-
-            '''
-            print(f"Tóner Amarillo: {toner_amarillo}")
-            print(f"Tóner Magenta: {toner_magenta}")
-            print(f"Tóner Cian: {toner_cian}")
-            print(f"Tóner Negro: {toner_negro}")
-            print(f"Kit alimentador: {kit_alimentador}")
-            '''
-
-            return {
-                "IP": ip,
-                "Toner Amarillo": toner_amarillo,
-                "Toner Magenta": toner_magenta,
-                "Toner Cian": toner_cian,
-                "Toner Negro": toner_negro,
-                "Kit Alim.": kit_alimentador,
-                'Estado': 'OK' if toner_amarillo else 'No disponible',
-                'Marca de Tiempo': timestamp
-            }
-        except (NoSuchElementException):
-            return {"IP": ip, "Toner Amarillo": "", "Toner Magenta": "", "Toner Cian": "", "Toner Negro": "", "Kit Alim.": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except TimeoutException:
-            return {"IP": ip, "Toner Amarillo": "", "Toner Magenta": "", "Toner Cian": "", "Toner Negro": "", "Kit Alim.": "", 'Estado': 'No Disponible', 'Marca de Tiempo': timestamp}
-        except WebDriverException:
-            print(f"Timeout al intentar conectar con {url}")
-            return {"IP": ip, "Toner Amarillo": "", "Toner Magenta": "", "Toner Cian": "", "Toner Negro": "", "Kit Alim.": "", 'Estado': 'Fuera de Red', 'Marca de Tiempo': timestamp}
-        finally:
-            driver.quit()
+    if guardado['nombres'] is None or any(nombre not in guardado['hojas'] for nombre in pedidas()):
+        with pd.ExcelFile(file_path) as libro:
+            guardado['nombres'] = libro.sheet_names
+            faltantes = [nombre for nombre in pedidas() if nombre not in guardado['hojas']]
+            if faltantes:
+                guardado['hojas'].update(pd.read_excel(libro, sheet_name=faltantes))
+        _escribir_pickle(file_path, guardado)
+    _HOJAS_EN_MEMORIA[firma[0]] = guardado
 
-    # Leer las hojas del archivo Excel
-    sheets = pd.read_excel(file_path, sheet_name=None)
-    wb = load_workbook(file_path)
-    column_widths = {sheet_name: get_column_widths(
-        wb[sheet_name]) for sheet_name in wb.sheetnames}
+    return {nombre: guardado['hojas'][nombre].copy() for nombre in pedidas()}
 
-    # Procesar la hoja 'Color Admin'
-    df_original = sheets['Color Planta']
-    df_original['IP'] = df_original['IP'].astype(str).apply(format_ip)
-    df_filtered = df_original[df_original['IP'].notna()]
 
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
+def abrir_libro(file_path):
+    """
+    Workbook de openpyxl para modificar. Si es el último que se guardó con
+    guardar_libro y nadie tocó el archivo desde entonces, se reutiliza sin
+    volver a leerlo.
+    """
+    from openpyxl import load_workbook
+
+    firma = firma_archivo(file_path)
+    guardado = _LIBROS_EN_MEMORIA.pop(firma[0], None)
+    if guardado is not None and guardado[0] == firma:
+        return guardado[1]
+    return load_workbook(file_path)
+
+
+def guardar_libro(wb, file_path):
+    wb.save(file_path)
+    _LIBROS_EN_MEMORIA[os.path.abspath(file_path)] = (firma_archivo(file_path), wb)
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_ip = {executor.submit(
-            fetch_data_from_url, ip, options): ip for ip in df_filtered['IP']}
-        results = [future.result() for future in as_completed(future_to_ip)]
 
-    df_results = pd.DataFrame(results)
+def leer_ips_por_hoja(file_path):
+    # Solo las hojas con perfil que existen en este libro
+    sheets = leer_hojas(file_path, PERFILES_POR_HOJA)
+    ips_por_hoja = {}
+    for sheet_name, df_sheet in sheets.items():
+        ips = df_sheet['IP'].astype(str).apply(format_ip)
+        ips_por_hoja[sheet_name] = list(ips[ips.notna()])
+    return ips_por_hoja
 
-    # Verificar que las columnas 'IP' existan antes de hacer el merge
-    if 'IP' not in df_original.columns or 'IP' not in df_results.columns:
-        raise KeyError("'IP' column is missing in one of the DataFrames.")
 
-    # Fusionar los resultados
-    df_updated = df_original.merge(
-        df_results, on='IP', how='left', suffixes=('', '_new')
+async def sondear_flota(ips, puertos=(80, 443), timeout=0.8, max_conexiones=256):
+    """
+    Intenta a la vez una conexión TCP a los puertos web de cada IP (sin
+    repetir) y devuelve el conjunto de las que contestaron en alguno.
+    """
+    limite = asyncio.Semaphore(max_conexiones)
+
+    async def conectar(ip, puerto):
+        async with limite:
+            try:
+                _, escritor = await asyncio.wait_for(
+                    asyncio.open_connection(*host_y_puerto(ip, puerto)), timeout)
+            except (OSError, asyncio.TimeoutError):
+                return None
+            escritor.close()
+            return ip
+
+    intentos = [conectar(ip, puerto) for ip in ips for puerto in puertos]
+    return {ip for ip in await asyncio.gather(*intentos) if ip}
+
+
+async def escanear_flota(ips_por_hoja, pool=None, sesion=None, controlador=None, timeout_host=60, fallos=None, sondeo_previo=True):
+    """
+    Consulta las impresoras de todas las hojas a la vez con un único límite
+    de concurrencia global, de modo que el tiempo total lo marque la
+    impresora más lenta y no la suma de las hojas.
+    Con `sondeo_previo`, las impresoras web que no aceptan conexión en el
+    puerto 80/443 quedan 'Fuera de Red' sin pasar por el colector.
+    Devuelve {hoja: [resultados]} con el mismo formato que los colectores.
+    """
+    loop = asyncio.get_running_loop()
+    controlador = controlador or ControladorConcurrencia()
+
+    # SNMP va por UDP: esas hojas no se sondean por TCP
+    ips_web = [ip for sheet_name, ips in ips_por_hoja.items() for ip in ips
+               if ip and PERFILES_POR_HOJA[sheet_name]['motor'] != "snmp"]
+    sondeadas = set(ips_web) if sondeo_previo else set()
+    sin_respuesta = set()
+    if sondeadas:
+        alcanzables = await sondear_flota(sondeadas)
+        sin_respuesta = sondeadas - alcanzables
+        print(f"Sondeo previo: {len(alcanzables)} de {len(sondeadas)} impresoras responden")
+
+    # Un hilo no se puede cancelar: los que vencen por timeout siguen
+    # ocupados un rato, por eso el executor tiene margen sobre el límite
+    executor = ThreadPoolExecutor(max_workers=controlador.maximo * 2)
+
+    async def consultar(sheet_name, ip, perfil=None):
+        perfil = perfil or PERFILES_POR_HOJA[sheet_name]
+        colector = colector_de_hoja(sheet_name, perfil)
+        en_espera = fallos is not None and fallos.en_espera(ip)
+        if ip in sin_respuesta:
+            if en_espera:
+                print(f"Omitiendo {ip} ({sheet_name}): sin respuesta desde {fallos.desde(ip)}")
+                return sheet_name, fallos.omitido(ip, list(perfil['campos']))
+            resultado = {**colector(None), "IP": ip, 'Estado': 'Fuera de Red', 'Marca de Tiempo': marca_de_tiempo()}
+            if fallos is not None:
+                fallos.registrar(resultado)
+            return sheet_name, resultado
+
+        if en_espera and ip not in sondeadas:
+            if not await loop.run_in_executor(executor, sondear, ip, perfil['motor']):
+                print(f"Omitiendo {ip} ({sheet_name}): sin respuesta desde {fallos.desde(ip)}")
+                return sheet_name, fallos.omitido(ip, list(perfil['campos']))
+
+        await controlador.adquirir_async()
+
+        inicio = time.monotonic()
+        timeout = False
+        try:
+            resultado = await asyncio.wait_for(
+                loop.run_in_executor(executor, colector, ip, pool, sesion),
+                timeout_host)
+            timeout = fue_timeout(resultado)
+        except asyncio.TimeoutError:
+            print(f"Timeout al consultar {ip} ({sheet_name})")
+            timeout = True
+            resultado = {**colector(None), "IP": ip, 'Estado': 'No Disponible', 'Marca de Tiempo': marca_de_tiempo()}
+        except Exception as e:
+            # Un error inesperado de una impresora no puede tirar abajo el
+            # escaneo de toda la flota
+            print(f"Error al consultar {ip} ({sheet_name}): {e!r}")
+            resultado = {**colector(None), "IP": ip, 'Estado': 'No Disponible', 'Marca de Tiempo': marca_de_tiempo()}
+        finally:
+            controlador.liberar(time.monotonic() - inicio, timeout)
+        if fallos is not None:
+            fallos.registrar(resultado)
+        return sheet_name, resultado
+
+    # La misma IP en varias hojas (o repetida en una) se consulta una vez
+    # y el resultado se reparte a cada hoja
+    lecturas = agrupar_lecturas(ips_por_hoja)
+
+    try:
+        tareas = [consultar(hojas[0], ip, perfil_combinado(hojas)) for ip, hojas in lecturas]
+        resultados = {sheet_name: [] for sheet_name in ips_por_hoja}
+        for (_, hojas), (_, resultado) in zip(lecturas, await asyncio.gather(*tareas)):
+            for sheet_name in hojas:
+                resultados[sheet_name].append(resultado_para_hoja(resultado, sheet_name))
+        repetidas = sum(len(ips) for ips in ips_por_hoja.values()) - len(lecturas)
+        if repetidas:
+            print(f"{repetidas} filas repetidas resueltas con la misma consulta")
+        print(controlador.resumen())
+        return resultados
+    finally:
+        executor.shutdown(wait=False)
+
+
+PORCENTAJE_BAJO = 11  # naranja por debajo de este porcentaje (rojo en 0 %)
+COLORES_ANTERIORES = ("FF0000", "FF6F00")  # los que se pintaban celda por celda
+
+
+def reglas_de_nivel(celda):
+    """Fórmulas de las reglas roja y naranja, relativas a la primera celda del rango."""
+    return (
+        f'AND({celda}<>"",OR({celda}=0,TRIM({celda})="0",TRIM({celda})="0%"))',
+        f'AND(RIGHT(TRIM({celda}),1)="%",VALUE(SUBSTITUTE({celda},"%",""))<{PORCENTAJE_BAJO})',
     )
 
-    # Restablecer columnas NaN
-    columns = ['Toner Amarillo', 'Toner Magenta', 'Toner Cian',
-               'Toner Negro', 'Kit Alim.', 'Estado', 'Marca de Tiempo']
-    df_updated[columns] = df_updated[columns].fillna('')
-
-    mask_ok = df_updated['Estado_new'] == 'OK'
-    columns = ['Toner Amarillo', 'Toner Magenta',
-               'Toner Cian', 'Toner Negro', 'Kit Alim.']
-
-    # 🔹 Crear las columnas *_new si no existen
-    for col in columns:
-        new_col = f"{col}_new"
-        if new_col not in df_updated.columns:
-            df_updated[new_col] = None
-
-    # 🔹 Actualizar valores
-    for col in columns:
-        df_updated[col] = df_updated[col].astype(str)
-        df_updated.loc[mask_ok, col] = df_updated.loc[mask_ok,
-                                                      f'{col}_new'].apply(clean_percentage)
-
-    df_updated['Estado'] = df_updated['Estado_new'].fillna(
-        df_updated['Estado'])
-    df_updated['Marca de Tiempo'] = df_updated['Marca de Tiempo_new'].fillna(
-        df_updated['Marca de Tiempo'])
-
-    columns_to_drop = [f'{col}_new' for col in columns +
-                       ['Estado', 'Marca de Tiempo']]
-    df_updated.drop(columns=[
-                    col for col in columns_to_drop if col in df_updated.columns], inplace=True)
-
-    # Guardar el DataFrame actualizado
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        df_updated.to_excel(
-            writer, sheet_name='Color Planta', index=False)
-        for sheet_name, df_sheet in sheets.items():
-            if sheet_name != 'Color Planta':
-                df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    # Aplicar fórmulas y formatos preservados
-    formulas = preserve_formulas_and_formats(file_path)
-    apply_formulas_and_formats(output_file, formulas)
-    # NO FUNCIONA
-    registrar_historico(file_path, df_updated)
-
-
-def format_excel_sheets(file_path):
-    wb = load_workbook(file_path)
-    red_font = Font(color="FF0000")
-    orange_font = Font(color="ff6f00")
-
-    print("Aplicando formato a todas las hojas:")
-    for sheet_name in wb.sheetnames:
-        ws = wb[sheet_name]
-        print(f"Procesando hoja: {sheet_name}")
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-            for cell in row:
-                cell_value = str(cell.value).strip()
-              # Comprobar si el valor es '0%' o '0' para aplicar el texto rojo
-                if cell_value in ['0%', '0']:
-                    cell.font = red_font
-                    print(
-                        f"Formato aplicado a celda: {cell.coordinate}, Valor: '{cell_value}' en hoja {sheet_name}")
-
-                # Comprobar si el valor es menor al 10% para aplicar el texto naranja
-                elif cell_value.endswith('%') and float(cell_value[:-1]) < 11:
-                    cell.font = orange_font
-                    print(
-                        f"Formato aplicado a celda: {cell.coordinate}, Valor: '{cell_value}' en hoja {sheet_name}")
-
-        # Ajustar el ancho de las columnas para cada hoja
-        column_widths = get_column_widths(ws)
-        for col, width in column_widths.items():
-            ws.column_dimensions[col].width = width
+
+def aplicar_formato(wb):
+    """
+    Instala en las columnas de consumibles de cada hoja reglas de formato
+    condicional (texto rojo en 0 %, naranja por debajo de PORCENTAJE_BAJO)
+    que Excel evalúa solo. Cubren la columna entera, así que las reglas ya
+    instaladas sirven para las filas nuevas y no se vuelven a agregar.
+    """
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.styles import Font
+
+    colores = (Font(color="FF0000"), Font(color="ff6f00"))
+    nuevas = 0
+    for ws in wb.worksheets:
+        existentes = {(str(cf.sqref), tuple(regla.formula))
+                      for cf in ws.conditional_formatting for regla in cf.rules}
+        for cell in ws[1]:
+            if cell.value not in CONSUMIBLES:
+                continue
+            letra = cell.column_letter
+            rango = f"{letra}2:{letra}1048576"
+            faltantes = [(formula, fuente) for formula, fuente in zip(reglas_de_nivel(f"{letra}2"), colores)
+                         if (rango, (formula,)) not in existentes]
+            if faltantes:
+                quitar_colores_anteriores(ws, cell.column)
+            for formula, fuente in faltantes:
+                ws.conditional_formatting.add(
+                    rango, FormulaRule(formula=[formula], font=fuente, stopIfTrue=True))
+                nuevas += 1
+    if nuevas:
+        print(f"Formato condicional: {nuevas} reglas instaladas")
 
     # Asegurar que "HP Admin" esté al principio
     if "HP Admin" in wb.sheetnames:
         wb.move_sheet("HP Admin", offset=-
                       wb.index(wb["HP Admin"]))
 
-    wb.save(file_path)
-    print("Formato aplicado y archivo guardado.")
 
+def quitar_colores_anteriores(ws, columna):
+    # Al instalar las reglas se borra el color fijo que dejaban las versiones
+    # anteriores; si no, taparía al de la regla cuando el nivel cambia
+    from copy import copy
 
+    for (cell,) in ws.iter_rows(min_row=2, min_col=columna, max_col=columna):
+        color = cell.font.color
+        if color is not None and isinstance(color.rgb, str) and color.rgb[-6:].upper() in COLORES_ANTERIORES:
+            fuente = copy(cell.font)
+            fuente.color = None
+            cell.font = fuente
 
-def registrar_historico(output_file, df_actual):
+
+def ajustar_anchos(ws, df, solo_ensanchar=False):
+    """
+    Ancho de cada columna según el texto más largo de `df` (que ya está
+    cargado) en vez de recorrer las celdas de la hoja. Con `solo_ensanchar`
+    las columnas nunca se achican, para cuando `df` tiene solo algunas filas.
+    """
+    encabezados = {cell.value: cell.column_letter for cell in ws[1] if cell.value is not None}
+    for col in df.columns:
+        if col not in encabezados:
+            continue
+        largo = df[col].dropna().astype(str).str.len().max()
+        ancho = max(len(str(col)), 0 if pd.isna(largo) else int(largo)) + 2
+        dimension = ws.column_dimensions[encabezados[col]]
+        if not solo_ensanchar or ancho > (dimension.width or 0):
+            dimension.width = ancho
+
+# 🚨 ESTA ES LA MODIFICACIÓN CLAVE: AÑADIR LOS NUEVOS TÓNERS
+COLUMNAS_HISTORICO = ['Nombre', 'IP', 'Modelo', 'Toner Negro', 'Toner Cian',
+                      'Toner Magenta', 'Toner Amarillo', 'Kit Mant.', 'Kit Alim.', 'Estado', 'Marca de Tiempo']
+
+
+# Histórico fuera del Excel: agregar lecturas cuesta lo mismo sin importar
+# cuántas haya guardadas. Va en disco local (ni WAL ni los renombres
+# atómicos del Parquet son confiables en una unidad de red)
+
+FORMATO_HISTORICO = "parquet"  # "parquet" (requiere pyarrow), "sqlite" o "excel"
+ARCHIVO_HISTORICO = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "historico_impresoras.sqlite")
+CARPETA_HISTORICO = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "historico_impresoras")
+ARCHIVOS_POR_MES = 50  # al pasar esta cantidad de archivos se compacta el mes
+NIVELES_HISTORICO = [col for col in COLUMNAS_HISTORICO
+                     if col not in ('Nombre', 'IP', 'Modelo', 'Estado', 'Marca de Tiempo')]
+
+
+def texto_celda(valor):
+    """Valor de una celda como texto (4250.0 -> "4250"), o None si está vacía."""
+    valor = valor_celda(valor)
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor)
+
+
+def normalizar_historico(df):
     """
-    Guarda los niveles actuales de tóner en una hoja llamada 'Histórico' 
-    dentro del mismo archivo Excel, sin borrar los registros anteriores.
+    Filas de `df` con IP y marca de tiempo válidas, con las columnas de la
+    hoja 'Histórico', la marca como fecha y los niveles como números.
     """
-    df_historico_nuevo = df_actual.copy()
+    marcas = pd.to_datetime(df['Marca de Tiempo'], errors='coerce')
+    ips = df['IP'].map(valor_celda)
+    validas = (ips.notna() & marcas.notna()).to_numpy()
+
+    datos = pd.DataFrame({'IP': ips[validas].astype(str), 'Marca de Tiempo': marcas[validas]})
+    for col in ('Nombre', 'Modelo', 'Estado'):
+        # Un modelo escrito como 4250 llega como número: todo va como texto
+        datos[col] = df[col][validas].map(texto_celda) if col in df.columns else None
+    for col in NIVELES_HISTORICO:
+        if col in df.columns:
+            datos[col] = pd.to_numeric(
+                df[col].astype(str).str.replace('%', '', regex=False).str.strip(),
+                errors='coerce')[validas].round()
+        else:
+            datos[col] = np.nan
+    return datos[COLUMNAS_HISTORICO].reset_index(drop=True)
 
-    # 🚨 ESTA ES LA MODIFICACIÓN CLAVE: AÑADIR LOS NUEVOS TÓNERS
-    columnas_historico = ['Nombre', 'IP', 'Modelo', 'Toner Negro', 'Toner Cian',
-                          'Toner Magenta', 'Toner Amarillo', 'Kit Mant.', 'Kit Alim.', 'Estado', 'Marca de Tiempo']
 
-    # Asegúrate de seleccionar solo las columnas que realmente existen en el DataFrame actual
-    columnas_a_seleccionar = [
-        col for col in columnas_historico if col in df_historico_nuevo.columns]
-    df_historico_nuevo = df_historico_nuevo[columnas_a_seleccionar]
+class Historico:
+    """Lo común a los formatos: importar y exportar la hoja 'Histórico'."""
 
-    try:
-        # Intenta leer el archivo y la hoja 'Histórico'
+    def cerrar(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def importar_excel(self, file_path, hoja="Histórico"):
         try:
-            # Abrir en modo 'a' (append) para modificar la hoja
-            with pd.ExcelWriter(output_file, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
+            df = leer_hojas(file_path, [hoja]).get(hoja)
+        except FileNotFoundError:
+            return 0
+        if df is None:
+            return 0
+        df.columns = df.columns.astype(str).str.strip()
+        return self.agregar(df, sin_repetir=True)
+
+    def exportar_excel(self, file_path, hoja="Histórico"):
+        """Reescribe la hoja `hoja` de `file_path` con todo el histórico."""
+        from openpyxl import Workbook
+
+        df = self.a_dataframe()
+        if os.path.exists(file_path):
+            wb = abrir_libro(file_path)
+            if hoja in wb.sheetnames:
+                del wb[hoja]
+        else:
+            wb = Workbook()
+            wb.remove(wb.active)
+        ws = wb.create_sheet(hoja)
+        ws.append(COLUMNAS_HISTORICO)
+        for fila in df.itertuples(index=False):
+            # Los niveles vuelven al formato de la hoja ("45%")
+            ws.append([f"{int(valor)}%" if col in NIVELES_HISTORICO and pd.notna(valor)
+                       else valor_celda(valor)
+                       for col, valor in zip(COLUMNAS_HISTORICO, fila)])
+        guardar_libro(wb, file_path)
+        return len(df)
+
+
+class HistoricoSQLite(Historico):
+    """
+    Una fila por lectura (IP, marca de tiempo, estado) y una muestra por
+    consumible con el nivel como entero. Solo se agrega: la misma IP con la
+    misma marca de tiempo se guarda una vez, así importar dos veces no duplica.
+    Agregar cuesta lo que las filas nuevas, no lo que ya hay guardado.
+    """
 
-                # Intentar leer los datos existentes
-                try:
-                    existing_df = pd.read_excel(
-                        output_file, sheet_name="Histórico")
+    def __init__(self, ruta=ARCHIVO_HISTORICO):
+        import sqlite3
+
+        self.ruta = ruta
+        self._conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS lecturas (
+                id INTEGER PRIMARY KEY,
+                ip TEXT NOT NULL,
+                marca TEXT NOT NULL,
+                estado TEXT,
+                nombre TEXT,
+                modelo TEXT,
+                UNIQUE (ip, marca)
+            );
+            CREATE TABLE IF NOT EXISTS muestras (
+                lectura INTEGER NOT NULL REFERENCES lecturas (id),
+                ip TEXT NOT NULL,
+                consumible TEXT NOT NULL,
+                marca TEXT NOT NULL,
+                nivel INTEGER NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS muestras_ip_consumible
+                ON muestras (ip, consumible, marca);
+            CREATE INDEX IF NOT EXISTS lecturas_marca ON lecturas (marca);""")
+
+    def cerrar(self):
+        self._conexion.close()
+
+    def vacio(self):
+        return self._conexion.execute("SELECT 1 FROM lecturas LIMIT 1").fetchone() is None
+
+    def agregar(self, df, sin_repetir=True):
+        """
+        Agrega las filas de `df` (columnas de la hoja 'Histórico'). Las
+        repetidas se descartan siempre. Devuelve cuántas eran nuevas.
+        """
+        if df.empty or 'IP' not in df.columns or 'Marca de Tiempo' not in df.columns:
+            return 0
+        datos = normalizar_historico(df)
+        ips = datos['IP'].tolist()
+        marcas = datos['Marca de Tiempo'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist()
+
+        lecturas = list(zip(ips, marcas, *([valor_celda(v) for v in datos[col]]
+                                           for col in ('Estado', 'Nombre', 'Modelo'))))
+        muestras = [(col, int(nivel), ip, marca)
+                    for col in NIVELES_HISTORICO
+                    for ip, marca, nivel in zip(ips, marcas, datos[col]) if pd.notna(nivel)]
+
+        with self._conexion:
+            self._conexion.execute("BEGIN")
+            antes = self._conexion.total_changes
+            self._conexion.executemany(
+                "INSERT OR IGNORE INTO lecturas (ip, marca, estado, nombre, modelo) VALUES (?, ?, ?, ?, ?)",
+                lecturas)
+            nuevas = self._conexion.total_changes - antes
+            # Las muestras de lecturas ya guardadas chocan con el índice único
+            self._conexion.executemany("""
+                INSERT OR IGNORE INTO muestras (lectura, ip, consumible, marca, nivel)
+                SELECT id, ip, ?, marca, ? FROM lecturas WHERE ip = ? AND marca = ?""", muestras)
+        return nuevas
+
+    def a_dataframe(self, estado=None, desde=None, ips=None, columnas=None):
+        """
+        Lecturas con las columnas de la hoja 'Histórico' y los niveles como
+        números, filtradas en la consulta por estado, fecha mínima e IPs.
+        """
+        condiciones, parametros = [], []
+        if estado is not None:
+            condiciones.append("l.estado = ?")
+            parametros.append(estado)
+        if desde is not None:
+            condiciones.append("l.marca >= ?")
+            parametros.append(pd.Timestamp(desde).strftime('%Y-%m-%d %H:%M:%S'))
+        if ips is not None:
+            ips = list(ips)
+            condiciones.append(f"l.ip IN ({', '.join('?' * len(ips))})")
+            parametros.extend(ips)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+        lecturas = pd.read_sql_query(
+            f"SELECT l.id, l.nombre, l.ip, l.modelo, l.estado, l.marca FROM lecturas l {donde} ORDER BY l.marca, l.id",
+            self._conexion, params=parametros, index_col="id")
+        muestras = pd.read_sql_query(
+            f"SELECT m.lectura, m.consumible, m.nivel FROM muestras m JOIN lecturas l ON l.id = m.lectura {donde}",
+            self._conexion, params=parametros)
+
+        df = lecturas.join(muestras.pivot(index="lectura", columns="consumible", values="nivel"))
+        df = df.rename(columns={'nombre': 'Nombre', 'ip': 'IP', 'modelo': 'Modelo',
+                                'estado': 'Estado', 'marca': 'Marca de Tiempo'})
+        for col in NIVELES_HISTORICO:
+            df[col] = df[col].astype(float) if col in df.columns else np.nan
+        return df[columnas or COLUMNAS_HISTORICO].reset_index(drop=True)
+
+
+def esquema_historico():
+    import pyarrow as pa
+
+    # IP, Modelo y Estado se repiten muchísimo: van como diccionario
+    texto_repetido = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [('Nombre', pa.string()), ('IP', texto_repetido), ('Modelo', texto_repetido)] +
+        [(col, pa.int8()) for col in NIVELES_HISTORICO] +
+        [('Estado', texto_repetido), ('Marca de Tiempo', pa.timestamp('s'))])
+
+
+class HistoricoParquet(Historico):
+    """
+    Histórico en Parquet, una carpeta por mes (mes=2026-01) con un archivo
+    por escritura; cuando un mes junta ARCHIVOS_POR_MES archivos se compacta
+    en uno. Al leer, pyarrow descarta por la carpeta los meses fuera del
+    rango y por las estadísticas de cada archivo las filas que no sirven,
+    así que cargar una ventana de días no lee todo el histórico.
+    """
 
-                    # Asegurarse de que las columnas coincidan para la concatenación
-                    # (Esto es útil si el historial antiguo no tenía las columnas de color)
-                    for col in columnas_a_seleccionar:
-                        if col not in existing_df.columns:
-                            existing_df[col] = ''
+    def __init__(self, carpeta=CARPETA_HISTORICO):
+        self.carpeta = carpeta
+        os.makedirs(carpeta, exist_ok=True)
+
+    def _partes(self, carpeta_mes="mes=*"):
+        # Los que empiezan con "_" se están escribiendo
+        return glob.glob(os.path.join(self.carpeta, carpeta_mes, "[!_]*.parquet"))
+
+    def _escribir(self, tabla, carpeta_mes):
+        import pyarrow.parquet as pq
+
+        nombre = f"{time.time_ns()}-{os.getpid()}.parquet"
+        temporal = os.path.join(carpeta_mes, "_" + nombre)
+        pq.write_table(tabla, temporal, compression="zstd")
+        os.replace(temporal, os.path.join(carpeta_mes, nombre))
+
+    def vacio(self):
+        return not self._partes()
+
+    def agregar(self, df, sin_repetir=False):
+        """
+        Agrega las filas de `df` (columnas de la hoja 'Histórico'). Con
+        `sin_repetir` se descartan las IP + marca de tiempo ya guardadas, lo
+        que obliga a leer los meses afectados (para importar, no para cada
+        lectura nueva). Devuelve cuántas filas se escribieron.
+        """
+        import pyarrow as pa
+
+        if df.empty or 'IP' not in df.columns or 'Marca de Tiempo' not in df.columns:
+            return 0
+        datos = normalizar_historico(df)
+        datos['Marca de Tiempo'] = datos['Marca de Tiempo'].astype('datetime64[s]')
+        datos = datos.drop_duplicates(subset=['IP', 'Marca de Tiempo'])
+        if sin_repetir and not datos.empty and not self.vacio():
+            guardadas = self.a_dataframe(desde=datos['Marca de Tiempo'].min(),
+                                         columnas=['IP', 'Marca de Tiempo'])
+            claves = pd.MultiIndex.from_frame(guardadas.astype({'Marca de Tiempo': 'datetime64[s]'}))
+            datos = datos[~pd.MultiIndex.from_frame(datos[['IP', 'Marca de Tiempo']]).isin(claves)]
+        if datos.empty:
+            return 0
+
+        for col in NIVELES_HISTORICO:
+            # Lo que no entra en int8 no es un porcentaje
+            datos[col] = datos[col].where(datos[col].between(0, 127)).astype("Int8")
+        esquema = esquema_historico()
+        for mes, grupo in datos.groupby(datos['Marca de Tiempo'].dt.strftime('%Y-%m')):
+            carpeta_mes = os.path.join(self.carpeta, f"mes={mes}")
+            os.makedirs(carpeta_mes, exist_ok=True)
+            self._escribir(pa.Table.from_pandas(grupo, schema=esquema, preserve_index=False),
+                           carpeta_mes)
+            if len(self._partes(f"mes={mes}")) > ARCHIVOS_POR_MES:
+                self.compactar(mes)
+        return len(datos)
+
+    def compactar(self, mes):
+        """Junta los archivos del mes en uno solo."""
+        import pyarrow.dataset as ds
+
+        partes = self._partes(f"mes={mes}")
+        tabla = ds.dataset(partes, format="parquet").to_table()
+        self._escribir(tabla.sort_by('Marca de Tiempo'), os.path.join(self.carpeta, f"mes={mes}"))
+        for parte in partes:
+            try:
+                os.remove(parte)
+            except OSError:
+                # Abierto por otro proceso: las filas repetidas se descartan al leer
+                pass
 
-                    # Combinar los datos antiguos con los nuevos
-                    df_final = pd.concat(
-                        [existing_df, df_historico_nuevo], ignore_index=True)
+    def a_dataframe(self, estado=None, desde=None, ips=None, columnas=None):
+        """
+        Lecturas con las columnas de la hoja 'Histórico' y los niveles como
+        números. Solo se leen las `columnas` pedidas y los filtros por
+        estado, fecha mínima e IPs se resuelven dentro de pyarrow.
+        """
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        columnas = list(columnas or COLUMNAS_HISTORICO)
+        if self.vacio():
+            return pd.DataFrame(columns=columnas)
+
+        condiciones = []
+        if estado is not None:
+            condiciones.append(ds.field('Estado') == estado)
+        if desde is not None:
+            desde = pd.Timestamp(desde)
+            condiciones.append(ds.field('mes') >= desde.strftime('%Y-%m'))
+            condiciones.append(ds.field('Marca de Tiempo') >=
+                               pa.scalar(desde.to_pydatetime(), pa.timestamp('s')))
+        if ips is not None:
+            condiciones.append(ds.field('IP').isin(list(ips)))
+        filtro = None
+        for condicion in condiciones:
+            filtro = condicion if filtro is None else filtro & condicion
+
+        dataset = ds.dataset(
+            self.carpeta, format="parquet",
+            partitioning=ds.partitioning(pa.schema([('mes', pa.string())]), flavor="hive"))
+        df = dataset.to_table(columns=columnas, filter=filtro).to_pandas()
+
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype(object)
+            elif col in NIVELES_HISTORICO:
+                df[col] = df[col].astype(float)
+        if 'IP' in df.columns and 'Marca de Tiempo' in df.columns:
+            df = df.sort_values('Marca de Tiempo', kind='stable').drop_duplicates(
+                subset=['IP', 'Marca de Tiempo'])
+        return df.reset_index(drop=True)
+
+
+def abrir_historico(libro=None):
+    """
+    Abre el histórico local según FORMATO_HISTORICO (sin pyarrow, el de
+    Parquet queda en SQLite). Si está vacío y se pasa `libro` (ruta o
+    Workbook abierto), primero importa lo que tenga su hoja 'Histórico'.
+    """
+    if FORMATO_HISTORICO == "parquet" and importlib.util.find_spec("pyarrow") is not None:
+        historico = HistoricoParquet()
+    else:
+        historico = HistoricoSQLite()
+    if libro is not None and historico.vacio():
+        if isinstance(libro, str):
+            importadas = historico.importar_excel(libro)
+        elif "Histórico" in libro.sheetnames:
+            importadas = historico.agregar(hoja_a_dataframe(libro["Histórico"]), sin_repetir=True)
+        else:
+            importadas = 0
+        if importadas:
+            print(f"Histórico importado de la hoja 'Histórico': {importadas} lecturas")
+    return historico
 
-                except (ValueError, FileNotFoundError):
-                    # La hoja 'Histórico' no existe, está vacía, o el archivo es nuevo.
-                    df_final = df_historico_nuevo
 
-                # Escribir la hoja combinada (sobrescribe solo la hoja Histórico)
-                df_final.to_excel(writer, sheet_name="Histórico", index=False)
+# Actualización del libro en una sola pasada
 
-        except FileNotFoundError:
-            # Si el archivo no existe, crearlo y agregar la hoja 'Histórico'
-            with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-                df_historico_nuevo.to_excel(
-                    writer, sheet_name="Histórico", index=False)
 
-        print(
-            f"✅ Registro histórico agregado ({len(df_historico_nuevo)} filas).")
+def hoja_a_dataframe(ws):
+    filas = ws.iter_rows(values_only=True)
+    encabezados = next(filas, ())
+    return pd.DataFrame(list(filas), columns=list(encabezados))
 
-    except Exception as e:
-        print(f"❌ Ocurrió un error al registrar el histórico: {e}")
+
+def valor_celda(valor):
+    # Las celdas sin dato quedan vacías en vez de guardar '' o NaN
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)) or valor == '':
+        return None
+    return valor
+
+
+def indice_por_ip(ws, columna_ip):
+    """{ip: [filas]} leyendo solo la columna IP de la hoja."""
+    indice = {}
+    celdas = ws.iter_rows(min_row=2, min_col=columna_ip, max_col=columna_ip, values_only=True)
+    for fila, (valor,) in enumerate(celdas, start=2):
+        ip = format_ip(str(valor)) if valor is not None else None
+        if ip:
+            indice.setdefault(ip, []).append(fila)
+    return indice
+
+
+def parchear_hoja(ws, results, columnas, limpiar, fallos=None):
+    """
+    Escribe en la hoja solo las celdas que cambian: niveles (si el estado
+    es OK), Estado, Marca de Tiempo y, con `fallos`, 'Sin datos desde'.
+    Las filas se buscan por IP; una IP repetida se actualiza en todas sus
+    filas y, si vino más de un resultado, vale el último.
+    Devuelve (filas de las impresoras consultadas para el histórico,
+    cantidad de celdas escritas).
+    """
+    encabezados = {cell.value: cell.column for cell in ws[1] if cell.value is not None}
+    if 'IP' not in encabezados:
+        raise KeyError(f"La hoja {ws.title} no tiene columna 'IP'")
+    indice = indice_por_ip(ws, encabezados['IP'])
+
+    historico, escritas = [], 0
+    for ip, result in {result['IP']: result for result in results}.items():
+        filas = indice.get(ip)
+        if not filas:
+            continue
+
+        nuevos = {}
+        if result.get('Estado') == 'OK':
+            nuevos.update({col: limpiar(result.get(col, np.nan)) for col in columnas})
+        for col in ('Estado', 'Marca de Tiempo'):
+            # Si el resultado no trae el dato se conserva el anterior
+            if col in result and not pd.isna(result[col]):
+                nuevos[col] = result[col]
+        if fallos is not None:
+            nuevos['Sin datos desde'] = fallos.desde(ip)
+
+        for fila in filas:
+            for col, valor in nuevos.items():
+                if col not in encabezados:
+                    continue
+                celda = ws.cell(row=fila, column=encabezados[col])
+                valor = valor_celda(valor)
+                if celda.value != valor:
+                    celda.value = valor
+                    escritas += 1
+
+        # Al histórico va la fila ya actualizada (con Nombre, Modelo, etc.),
+        # salvo si la impresora no se consultó (omitida por la caché de fallos)
+        if pd.isna(result.get('Marca de Tiempo')):
+            continue
+        historico.append({col: ws.cell(row=filas[0], column=encabezados[col]).value
+                          for col in COLUMNAS_HISTORICO if col in encabezados})
+    return historico, escritas
+
+
+def agregar_historico(wb, df_actual):
+    """
+    Agrega las filas a la hoja 'Histórico' del libro ya abierto (con
+    FORMATO_HISTORICO = "excel"), sin leerla ni reescribirla.
+    """
+    columnas = [col for col in COLUMNAS_HISTORICO if col in df_actual.columns]
+
+    if "Histórico" in wb.sheetnames:
+        ws = wb["Histórico"]
+        encabezados = [cell.value for cell in ws[1]]
+        if ws.max_row == 1 and all(v is None for v in encabezados):
+            encabezados = []
+    else:
+        ws = wb.create_sheet("Histórico")
+        encabezados = []
+
+    # Las columnas nuevas (p. ej. las de color) se agregan al final
+    for col in columnas:
+        if col not in encabezados:
+            encabezados.append(col)
+            ws.cell(row=1, column=len(encabezados), value=col)
+
+    for fila in df_actual[columnas].itertuples(index=False):
+        valores = dict(zip(columnas, fila))
+        ws.append([valor_celda(valores.get(col)) for col in encabezados])
+
+    print(f"✅ Registro histórico agregado ({len(df_actual)} filas).")
+
+
+def agregar_columna(ws, columna):
+    encabezados = [cell.value for cell in ws[1]]
+    if columna not in encabezados:
+        ws.cell(row=1, column=len(encabezados) + 1, value=columna)
+
+
+def actualizar_libro(file_path, resultados, output_file=None, fallos=None):
+    """
+    Aplica los resultados de todas las hojas en una sola pasada: abre el
+    libro una vez, actualiza las hojas y el histórico, aplica el formato y
+    guarda una sola vez. Solo se escriben las celdas que cambiaron, así las
+    fórmulas, los formatos y las demás hojas quedan intactos.
+    Con `fallos`, la columna 'Sin datos desde' indica desde cuándo los
+    niveles de una impresora caída son los últimos conocidos.
+    """
+    wb = abrir_libro(file_path)
+    aplicar_en_libro(wb, resultados, fallos)
+    guardar_libro(wb, output_file or file_path)
+    print("Formato aplicado y archivo guardado.")
+
+
+def aplicar_en_libro(wb, resultados, fallos=None):
+    """Parte de actualizar_libro que trabaja sobre un libro ya abierto."""
+    df_historico, escritas = [], 0
+
+    for sheet_name, results in resultados.items():
+        if sheet_name not in wb.sheetnames or not results:
+            continue
+
+        ws = wb[sheet_name]
+        if fallos is not None:
+            agregar_columna(ws, 'Sin datos desde')
+        # Al histórico solo van las impresoras consultadas en esta pasada
+        filas, cambios = parchear_hoja(
+            ws, results, columnas_de_hoja(sheet_name),
+            PERFILES_POR_HOJA[sheet_name]['limpiar'], fallos)
+        df_historico.extend(filas)
+        escritas += cambios
+        if filas:
+            ajustar_anchos(ws, pd.DataFrame(filas), solo_ensanchar=True)
+    print(f"{escritas} celdas actualizadas")
+
+    if df_historico:
+        df_historico = pd.DataFrame(df_historico)
+        if FORMATO_HISTORICO != "excel":
+            # Un histórico que no se puede escribir no debe impedir que se
+            # guarden las lecturas en el libro
+            try:
+                with abrir_historico(wb) as historico:
+                    nuevas = historico.agregar(df_historico)
+                print(f"✅ Registro histórico agregado ({nuevas} filas).")
+            except Exception as e:
+                print(f"❌ No se pudo registrar el histórico: {e!r}")
+        else:
+            agregar_historico(wb, df_historico)
+
+    aplicar_formato(wb)
 
 
 def predecir_consumible(sub_df, consumible, VENTANA_EMA, MAX_DIAS_PREDICCION):
@@ -879,6 +2297,8 @@ def predecir_consumible(sub_df, consumible, VENTANA_EMA, MAX_DIAS_PREDICCION):
 
     if np.isnan(consumo_diario) or consumo_diario <= 0:
         if len(sub_df) >= 3:
+            from sklearn.linear_model import LinearRegression
+
             X = sub_df[["Días"]].values
             model = LinearRegression()
             model.fit(X, y[:len(X)])
@@ -969,33 +2389,569 @@ def predecir_consumible_promedio(CONSUMIBLES, df, OUTPUT_FILE, DIAS_ALERTA_CRITI
 
 
 
-def menu():
-   # input_file = r"C:\Users\jvargas\Downloads\Impresoras - final.xlsx"
-    input_file = r"G:\Unidades compartidas\Informática\Impresoras - final.xlsx"
+# Coordinador y trabajadores: una cola reparte las IPs entre equipos de
+# distintas subredes. El coordinador la guarda en un SQLite local y la
+# publica por red ("host:puerto"); los trabajadores de otros equipos se
+# conectan a esa dirección. Los bloqueos de SQLite no son confiables en
+# unidades de red, así que el archivo solo se comparte entre procesos del
+# mismo equipo. El coordinador encola, espera los resultados y escribe el
+# libro una vez.
+
+COLA_TRABAJOS = "cola_impresoras.sqlite"
+
+# Clave compartida entre coordinador y trabajadores: la conexión de
+# multiprocessing viaja con pickle, así que sin clave no se publica nada
+VARIABLE_CLAVE_COLA = "CLAVE_COLA_IMPRESORAS"
+
+
+class MarcasSinDatos(dict):
+    """{ip: desde} informado por los trabajadores, con la interfaz de CacheFallos."""
+
+    def desde(self, ip):
+        return self.get(ip)
+
+
+class ColaTrabajos:
+    def __init__(self, ruta=COLA_TRABAJOS):
+        import sqlite3
+
+        self.ruta = ruta
+        # El servidor de red atiende a cada trabajador en su propio hilo
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS trabajos (
+                id INTEGER PRIMARY KEY,
+                corrida TEXT NOT NULL,
+                hoja TEXT NOT NULL,
+                ip TEXT NOT NULL,
+                estado TEXT NOT NULL DEFAULT 'pendiente',
+                trabajador TEXT,
+                tomado_en REAL,
+                resultado TEXT,
+                sin_datos_desde TEXT
+            )""")
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (corrida, estado)")
+        # Solo se reparten trabajos de corridas abiertas
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS corridas (
+                corrida TEXT PRIMARY KEY,
+                abierta INTEGER NOT NULL DEFAULT 1
+            )""")
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+    def encolar(self, corrida, ips_por_hoja):
+        # Una vez por hoja e IP, aunque la IP esté repetida en la hoja
+        filas = [(corrida, sheet_name, ip)
+                 for sheet_name, ips in ips_por_hoja.items()
+                 for ip in dict.fromkeys(ips) if ip]
+        with self._lock, self._conexion:
+            self._conexion.execute("BEGIN")
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO corridas (corrida, abierta) VALUES (?, 1)", (corrida,))
+            self._conexion.executemany(
+                "INSERT INTO trabajos (corrida, hoja, ip) VALUES (?, ?, ?)", filas)
+        return len(filas)
+
+    def cerrar_corridas(self, corrida=None):
+        """
+        Cierra `corrida` (o todas las abiertas) y cancela sus trabajos sin
+        terminar, para que ningún trabajador los vuelva a tomar.
+        """
+        filtro, parametros = ("WHERE corrida = ?", (corrida,)) if corrida else ("WHERE abierta = 1", ())
+        with self._lock, self._conexion:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            cerradas = [fila[0] for fila in self._conexion.execute(
+                f"SELECT corrida FROM corridas {filtro}", parametros)]
+            self._conexion.executemany(
+                "UPDATE corridas SET abierta = 0 WHERE corrida = ?", [(c,) for c in cerradas])
+            self._conexion.executemany(
+                "UPDATE trabajos SET estado = 'cancelado' WHERE corrida = ? AND estado != 'listo'",
+                [(c,) for c in cerradas])
+        return cerradas
+
+    def tomar(self, trabajador, cantidad=10, prefijo=None, vencimiento=300):
+        """
+        Reserva hasta `cantidad` trabajos pendientes (o tomados por un
+        trabajador que no respondió en `vencimiento` segundos). Con `prefijo`
+        ("192.168.111.") solo toma IPs de esa subred.
+        Devuelve [(id, hoja, ip)].
+        """
+        ahora = time.time()
+        with self._lock, self._conexion:
+            # IMMEDIATE: dos trabajadores no pueden tomar el mismo trabajo
+            self._conexion.execute("BEGIN IMMEDIATE")
+            trabajos = self._conexion.execute("""
+                SELECT id, hoja, ip FROM trabajos
+                WHERE (estado = 'pendiente' OR (estado = 'tomado' AND tomado_en < ?))
+                  AND corrida IN (SELECT corrida FROM corridas WHERE abierta = 1)
+                  AND ip LIKE ?
+                ORDER BY id LIMIT ?""",
+                (ahora - vencimiento, (prefijo or "") + "%", cantidad)).fetchall()
+            self._conexion.executemany(
+                "UPDATE trabajos SET estado = 'tomado', trabajador = ?, tomado_en = ? WHERE id = ?",
+                [(trabajador, ahora, id_trabajo) for id_trabajo, _, _ in trabajos])
+        return trabajos
+
+    def entregar(self, id_trabajo, resultado, sin_datos_desde=None):
+        with self._lock, self._conexion:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            self._conexion.execute(
+                # Un trabajo cancelado (corrida cerrada) ya no se espera
+                "UPDATE trabajos SET estado = 'listo', resultado = ?, sin_datos_desde = ? "
+                "WHERE id = ? AND estado = 'tomado'",
+                (json.dumps(resultado, default=str), sin_datos_desde, id_trabajo))
+
+    def faltantes(self, corrida):
+        with self._lock:
+            return self._conexion.execute(
+                "SELECT COUNT(*) FROM trabajos WHERE corrida = ? AND estado != 'listo'",
+                (corrida,)).fetchone()[0]
+
+    def resultados(self, corrida):
+        """({hoja: [resultados]}, MarcasSinDatos) de los trabajos terminados."""
+        resultados, sin_datos = {}, MarcasSinDatos()
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT hoja, ip, resultado, sin_datos_desde FROM trabajos "
+                "WHERE corrida = ? AND estado = 'listo' ORDER BY id", (corrida,)).fetchall()
+        for sheet_name, ip, resultado, desde in filas:
+            resultados.setdefault(sheet_name, []).append(json.loads(resultado))
+            if desde:
+                sin_datos[ip] = desde
+        return resultados, sin_datos
+
+
+def es_direccion_cola(ruta_cola):
+    """"host:puerto" es un coordinador en la red; otra cosa, un archivo SQLite."""
+    host, _, puerto = ruta_cola.rpartition(":")
+    return bool(host) and puerto.isdigit()
+
+
+def _clave_cola():
+    clave = os.environ.get(VARIABLE_CLAVE_COLA)
+    if not clave:
+        raise ValueError(f"Defina la variable de entorno {VARIABLE_CLAVE_COLA} "
+                         "con la misma clave en el coordinador y los trabajadores")
+    return clave.encode()
+
+
+def servir_cola(cola, direccion):
+    """
+    Publica tomar() y entregar() de `cola` en `direccion` ("host:puerto")
+    para los trabajadores de otros equipos. Devuelve el servidor, que se
+    detiene con detener_cola().
+    """
+    from multiprocessing.managers import BaseManager
+
+    class ServidorCola(BaseManager):
+        pass
+
+    ServidorCola.register("cola", callable=lambda: cola, exposed=("tomar", "entregar"))
+    host, puerto = direccion.rsplit(":", 1)
+    servidor = ServidorCola(address=(host, int(puerto)), authkey=_clave_cola()).get_server()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def detener_cola(servidor):
+    servidor.stop_event.set()
+    servidor.listener.close()
+
+
+def conectar_cola(direccion):
+    """Cola del coordinador en `direccion`, con tomar() y entregar()."""
+    from multiprocessing.managers import BaseManager
+
+    class ClienteCola(BaseManager):
+        pass
+
+    ClienteCola.register("cola")
+    host, puerto = direccion.rsplit(":", 1)
+    cliente = ClienteCola(address=(host, int(puerto)), authkey=_clave_cola())
+    cliente.connect()
+    return cliente.cola()
+
+
+def preparar_consulta():
+    """Sesión HTTP, controlador y navegadores según MOTOR_HP y MODO_NAVEGADOR."""
+    sesion = crear_sesion_http() if MOTOR_HP == "http" else None
+    if MODO_NAVEGADOR == "pestanas":
+        controlador = ControladorConcurrencia(inicial=10, maximo=50)
+        navegador = PestanasChrome(pestanas=controlador.maximo)
+    else:
+        controlador = ControladorConcurrencia()
+        navegador = PoolDrivers(tamano=controlador.maximo)
+    return sesion, controlador, navegador
+
+
+def coordinar(input_file, ruta_cola=COLA_TRABAJOS, espera_maxima=30 * 60, escuchar=None):
+    """
+    Encola las IPs del libro, espera a que los trabajadores terminen (o a
+    `espera_maxima` segundos) y aplica lo recibido en una sola escritura.
+    Las impresoras sin resultado conservan sus valores anteriores.
+    Con `escuchar` ("host:puerto") la cola se publica para los trabajadores
+    de otros equipos mientras dura la corrida.
+    """
+    cola = ColaTrabajos(ruta_cola)
+    servidor = None
+    corrida = None
+    try:
+        # Las corridas de un coordinador que terminó mal no se siguen repartiendo
+        anteriores = cola.cerrar_corridas()
+        if anteriores:
+            print(f"Cerradas {len(anteriores)} corridas anteriores sin terminar")
+        corrida = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        total = cola.encolar(corrida, leer_ips_por_hoja(input_file))
+        print(f"Corrida {corrida}: {total} impresoras en la cola {ruta_cola}")
+        if escuchar:
+            servidor = servir_cola(cola, escuchar)
+            print(f"Esperando trabajadores en {escuchar}")
+
+        limite = time.monotonic() + espera_maxima
+        faltantes = total
+        while faltantes and time.monotonic() < limite:
+            time.sleep(2)
+            restantes = cola.faltantes(corrida)
+            if restantes != faltantes:
+                print(f"Terminadas {total - restantes} de {total}")
+            faltantes = restantes
+        if faltantes:
+            print(f"⚠️ {faltantes} impresoras sin resultado; quedan con sus valores anteriores")
+
+        resultados, sin_datos = cola.resultados(corrida)
+    finally:
+        if servidor is not None:
+            detener_cola(servidor)
+        if corrida is not None:
+            cola.cerrar_corridas(corrida)
+        cola.cerrar()
+    actualizar_libro(input_file, resultados, fallos=sin_datos)
+
+
+def trabajar(ruta_cola=COLA_TRABAJOS, nombre=None, prefijo=None, lote=10, esperar=False):
+    """
+    Toma lotes de la cola y los consulta con los perfiles de siempre,
+    entregando cada lote al terminarlo. `ruta_cola` es el SQLite local o la
+    dirección "host:puerto" del coordinador. Sin `esperar` termina cuando la
+    cola queda vacía o el coordinador deja de responder.
+    """
+    nombre = nombre or f"{socket.gethostname()}-{os.getpid()}"
+    remota = es_direccion_cola(ruta_cola)
+    cola = None if remota else ColaTrabajos(ruta_cola)
+    fallos = CacheFallos()
+    sesion, controlador, navegador = preparar_consulta()
+    try:
+        with navegador as pool:
+            while True:
+                try:
+                    if cola is None:
+                        cola = conectar_cola(ruta_cola)
+                    trabajos = cola.tomar(nombre, lote, prefijo)
+                except (OSError, EOFError):
+                    # Coordinador todavía no levantado o corrida terminada
+                    print(f"{nombre}: sin conexión con el coordinador {ruta_cola}")
+                    cola, trabajos = None, []
+                if not trabajos:
+                    if not esperar:
+                        break
+                    time.sleep(5)
+                    continue
+
+                ips_por_hoja = {}
+                for _, sheet_name, ip in trabajos:
+                    ips_por_hoja.setdefault(sheet_name, []).append(ip)
+                resultados = asyncio.run(escanear_flota(
+                    ips_por_hoja, pool, sesion, controlador, fallos=fallos))
+
+                # Cada trabajo se entrega por su id, aunque el lote traiga la
+                # misma hoja e IP más de una vez
+                ids = {}
+                for id_trabajo, sheet_name, ip in trabajos:
+                    ids.setdefault((sheet_name, ip), []).append(id_trabajo)
+                fallos.guardar()
+                try:
+                    for sheet_name, results in resultados.items():
+                        for resultado in results:
+                            for id_trabajo in ids.get((sheet_name, resultado['IP']), []):
+                                cola.entregar(id_trabajo, resultado, fallos.desde(resultado['IP']))
+                except (OSError, EOFError):
+                    # El coordinador cerró la corrida: el lote ya no se espera
+                    print(f"{nombre}: el coordinador {ruta_cola} no recibió el lote")
+                    cola = None
+                    continue
+                print(f"{nombre}: {len(trabajos)} impresoras entregadas")
+    finally:
+        if cola is not None and not remota:
+            cola.cerrar()
+
+
+# Modo demonio: consulta continua, cada impresora con su propio intervalo
+
+INTERVALO_POR_DEFECTO = 30 * 60  # segundos, si el perfil no indica 'intervalo'
+
+
+def leer_agenda(file_path, intervalo=None):
+    """
+    [(hoja, ip, segundos, fijo)] con el intervalo de cada impresora: la
+    columna opcional 'Intervalo (min)' de la hoja (fijo), o el 'intervalo'
+    del perfil.
+    """
+    agenda = []
+    for sheet_name, df_sheet in leer_hojas(file_path, PERFILES_POR_HOJA).items():
+        por_defecto = PERFILES_POR_HOJA[sheet_name].get(
+            'intervalo', intervalo or INTERVALO_POR_DEFECTO)
+        minutos = pd.to_numeric(df_sheet.get('Intervalo (min)', pd.Series(index=df_sheet.index, dtype=float)),
+                                errors='coerce')
+        ips = df_sheet['IP'].astype(str).apply(format_ip)
+        for ip, propio in zip(ips, minutos):
+            if pd.notna(ip) and ip:
+                fijo = bool(propio > 0)
+                agenda.append((sheet_name, ip, propio * 60 if fijo else por_defecto, fijo))
+    return agenda
+
+
+# Prioridad por desgaste: las impresoras que se van a quedar sin tóner se
+# leen seguido y las que están llenas, de vez en cuando
+
+HORIZONTE_DIAS = 30  # desde aquí hacia arriba se usa el intervalo máximo
+
+
+def dias_restantes_por_ip(df_historico):
+    """{ip: días} hasta que se agote el primer consumible, según predecir_consumible."""
+    dias_por_ip = {}
+    for ip, grupo in df_historico.groupby("IP"):
+        dias = []
+        for consumible in CONSUMIBLES:
+            if consumible not in grupo or grupo[consumible].dropna().empty:
+                continue
+            _, consumo, restantes, _, _ = predecir_consumible(
+                grupo, consumible, VENTANA_EMA, MAX_DIAS_PREDICCION)
+            if consumo == 0 and pd.isna(restantes):
+                # No está bajando: cuenta como lleno
+                restantes = MAX_DIAS_PREDICCION
+            if pd.notna(restantes):
+                dias.append(restantes)
+        if dias:
+            dias_por_ip[ip] = min(dias)
+    return dias_por_ip
+
+
+def intervalo_por_desgaste(dias, minimo, maximo):
+    """Escala logarítmica: 1 día o menos -> minimo, HORIZONTE_DIAS o más -> maximo."""
+    if dias is None:
+        # Sin predicción: un punto intermedio
+        return math.sqrt(minimo * maximo)
+    avance = math.log(max(dias, 1)) / math.log(HORIZONTE_DIAS)
+    return minimo * (maximo / minimo) ** min(1.0, avance)
+
+
+def planificar_por_desgaste(agenda, df_historico, minimo=5 * 60, maximo=6 * 60 * 60, presupuesto_hora=None):
+    """
+    Reemplaza los intervalos no fijos de la agenda según los días que le
+    quedan a cada impresora. Con `presupuesto_hora` (lecturas por hora en
+    total) se alargan todos por igual, sin pasar de `maximo`, hasta entrar
+    en el presupuesto.
+    """
+    dias_por_ip = dias_restantes_por_ip(df_historico)
+    agenda = [(sheet_name, ip,
+               segundos if fijo else intervalo_por_desgaste(dias_por_ip.get(ip), minimo, maximo), fijo)
+              for sheet_name, ip, segundos, fijo in agenda]
+    if not presupuesto_hora:
+        return agenda
+
+    fijas = sum(3600 / segundos for _, _, segundos, fijo in agenda if fijo)
+    variables = [segundos for _, _, segundos, fijo in agenda if not fijo]
+
+    def lecturas(factor):
+        return fijas + sum(3600 / min(maximo, segundos * factor) for segundos in variables)
+
+    if lecturas(1) <= presupuesto_hora:
+        return agenda
+    if lecturas(maximo / minimo) > presupuesto_hora:
+        print(f"⚠️ Ni con el intervalo máximo se entra en {presupuesto_hora} lecturas por hora")
+        factor = maximo / minimo
+    else:
+        # Búsqueda binaria del menor factor que entra en el presupuesto
+        bajo, alto = 1.0, maximo / minimo
+        for _ in range(40):
+            factor = (bajo + alto) / 2
+            if lecturas(factor) > presupuesto_hora:
+                bajo = factor
+            else:
+                alto = factor
+        factor = alto
+    return [(sheet_name, ip, segundos if fijo else min(maximo, segundos * factor), fijo)
+            for sheet_name, ip, segundos, fijo in agenda]
+
+
+class LibroEnMemoria:
+    """
+    Mantiene el libro abierto entre ciclos del demonio. Si alguien guarda
+    el archivo por su cuenta se vuelve a leer antes de escribir, para no
+    pisar sus cambios.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.wb = None
+        self._firma = None
+
+    def cambio_afuera(self):
+        return self._firma != firma_archivo(self.ruta)
+
+    def libro(self):
+        from openpyxl import load_workbook
+
+        if self.wb is None or self.cambio_afuera():
+            self.wb = load_workbook(self.ruta)
+            self._firma = firma_archivo(self.ruta)
+        return self.wb
+
+    def guardar(self):
+        self.wb.save(self.ruta)
+        self._firma = firma_archivo(self.ruta)
 
-    OUTPUT_FILE = "predicciones_toner_ema.xlsx"
+    def descartar(self):
+        """Olvida el libro en memoria: el próximo libro() lo lee de nuevo."""
+        self.wb = None
+        self._firma = None
 
-    TONER_COLUMNS = ["Toner Negro", "Toner Cian",
-                    "Toner Magenta", "Toner Amarillo"]
-    KITS_COLUMNS = ["Kit Mant.", "Kit Alim."]
-    CONSUMIBLES = TONER_COLUMNS + KITS_COLUMNS
 
-    ESTADO_VALIDO = "OK"
-    VENTANA_EMA = 10
-    DIAS_ALERTA_CRITICA = 3
-    DIAS_ALERTA_MEDIA = 7
-    MAX_DIAS_PREDICCION = 365 * 2  # máximo 2 años
+REINTENTOS_AL_SALIR = 6  # cada 10 s, si el libro está bloqueado al detener el demonio
 
 
+def demonio(input_file, intervalo=None, guardar_cada=60, prioridad=None, replanificar_cada=60 * 60):
+    """
+    Consulta sin parar: cada impresora se vuelve a leer cuando vence su
+    intervalo. Sesión, navegadores, caché de fallos y libro quedan abiertos
+    entre ciclos, y el libro se guarda como mucho cada `guardar_cada` s.
+    Con `prioridad` ({'minimo', 'maximo', 'presupuesto_hora'}) los
+    intervalos salen de planificar_por_desgaste y se recalculan cada
+    `replanificar_cada` s con el histórico nuevo.
+    Se detiene con Ctrl+C (guarda lo pendiente antes de salir).
+    Si el libro está bloqueado (abierto en Excel) las lecturas quedan
+    pendientes y se reintenta en el próximo guardado.
+    """
+    libro = LibroEnMemoria(input_file)
+    fallos = CacheFallos()
+    sesion, controlador, navegador = preparar_consulta()
+
+    def programar(anteriores=()):
+        # Las impresoras que ya estaban conservan su próxima lectura
+        previas = {(sheet_name, ip): cuando for cuando, sheet_name, ip in anteriores}
+        ahora = time.monotonic()
+        agenda = leer_agenda(input_file, intervalo)
+        if prioridad is not None:
+            historico = cargar_historico(
+                input_file, CONSUMIBLES, ESTADO_VALIDO, DIAS_HISTORIA_PREDICCION,
+                ips=sorted({ip for _, ip, _, _ in agenda}))
+            agenda = planificar_por_desgaste(agenda, historico, **prioridad)
+        intervalos = {(sheet_name, ip): segundos for sheet_name, ip, segundos, _ in agenda}
+        proximas = [(previas.get(clave, ahora), *clave) for clave in intervalos]
+        heapq.heapify(proximas)
+        lecturas = sum(3600 / segundos for segundos in intervalos.values())
+        print(f"Demonio: {len(proximas)} impresoras en la agenda, ~{lecturas:.0f} lecturas por hora")
+        return intervalos, proximas
+
+    intervalos, proximas = programar()
+    pendientes = {}
+    ultimo_guardado = ultima_planificacion = time.monotonic()
+
+    def guardar():
+        """Devuelve False si el libro no se pudo guardar."""
+        nonlocal pendientes, ultimo_guardado, intervalos, proximas
+        if pendientes:
+            recargar = libro.wb is not None and libro.cambio_afuera()
+            try:
+                aplicar_en_libro(libro.libro(), pendientes, fallos)
+                libro.guardar()
+            except OSError as e:
+                # El libro en memoria ya tiene los cambios a medio aplicar:
+                # se descarta y el próximo intento parte del archivo
+                libro.descartar()
+                ultimo_guardado = time.monotonic()
+                print(f"{marca_de_tiempo()}: no se pudo guardar el libro ({e}); "
+                      f"se reintenta en {guardar_cada} s")
+                return False
+            fallos.guardar()
+            print(f"{marca_de_tiempo()}: libro guardado "
+                  f"({sum(len(r) for r in pendientes.values())} lecturas)")
+            pendientes = {}
+            if recargar:
+                # Puede haber impresoras nuevas o quitadas
+                intervalos, proximas = programar(proximas)
+        ultimo_guardado = time.monotonic()
+        return True
+
+    try:
+        with navegador as pool:
+            while True:
+                ahora = time.monotonic()
+                vencidas = {}
+                while proximas and proximas[0][0] <= ahora:
+                    _, sheet_name, ip = heapq.heappop(proximas)
+                    vencidas.setdefault(sheet_name, []).append(ip)
+
+                if vencidas:
+                    resultados = asyncio.run(escanear_flota(
+                        vencidas, pool, sesion, controlador, fallos=fallos))
+                    fin = time.monotonic()
+                    for sheet_name, results in resultados.items():
+                        pendientes.setdefault(sheet_name, []).extend(results)
+                        for ip in vencidas[sheet_name]:
+                            heapq.heappush(proximas, (fin + intervalos[(sheet_name, ip)], sheet_name, ip))
+
+                if time.monotonic() - ultimo_guardado >= guardar_cada:
+                    guardar()
+
+                if prioridad is not None and time.monotonic() - ultima_planificacion >= replanificar_cada:
+                    guardar()
+                    intervalos, proximas = programar(proximas)
+                    ultima_planificacion = time.monotonic()
+
+                siguiente = proximas[0][0] if proximas else time.monotonic() + guardar_cada
+                time.sleep(max(0.5, min(siguiente, ultimo_guardado + guardar_cada) - time.monotonic()))
+    except KeyboardInterrupt:
+        print("Deteniendo el demonio...")
+    finally:
+        for _ in range(REINTENTOS_AL_SALIR):
+            if guardar():
+                break
+            print("Cierre el libro en Excel para guardar las lecturas pendientes")
+            time.sleep(10)
+        else:
+            print(f"⚠️ {sum(len(r) for r in pendientes.values())} lecturas sin guardar")
+
+
+def cargar_historico(input_file, CONSUMIBLES, ESTADO_VALIDO, dias=None, ips=None):
     # --------------------------------------------------
     # CARGA Y LIMPIEZA DE DATOS
     # --------------------------------------------------
-    df = pd.read_excel(input_file, sheet_name="Histórico")
+    # Con `dias` solo se cargan las lecturas de los últimos `dias` días y con
+    # `ips`, solo las de esas impresoras
+    desde = datetime.now() - timedelta(days=dias) if dias else None
+    if FORMATO_HISTORICO != "excel":
+        with abrir_historico(input_file) as historico:
+            df = historico.a_dataframe(
+                estado=ESTADO_VALIDO, desde=desde, ips=ips,
+                columnas=['Nombre', 'IP', 'Modelo', *CONSUMIBLES, 'Estado', 'Marca de Tiempo'])
+    else:
+        df = leer_hojas(input_file, ["Histórico"])["Histórico"]
     df.columns = df.columns.str.strip()
+    if ips is not None:
+        df = df[df["IP"].isin(list(ips))]
 
     df["Fecha de registro"] = pd.to_datetime(
         df["Marca de Tiempo"], errors="coerce")
     df = df[df["Estado"].str.strip() == ESTADO_VALIDO].copy()
+    if desde is not None:
+        df = df[df["Fecha de registro"] >= desde]
 
     for col in CONSUMIBLES:
         df[col] = (
@@ -1010,6 +2966,48 @@ def menu():
     df.sort_values("Fecha de registro", ascending=False, inplace=True)
     df.drop_duplicates(subset=["IP", "Marca de Tiempo"],
                     keep="first", inplace=True)
+    return df
+
+
+def perfil_arranque():
+    """Informe de --startup-profile: cuánto cuesta abrir el menú y cuánto cada opción."""
+    print(f"Imports de arranque de menu.py: {_FIN_IMPORTS - _INICIO_IMPORTS:.3f} s")
+    diferidos = [
+        ("pandas", "opciones 1 y 2"),
+        ("numpy", "opciones 1 y 2"),
+        ("openpyxl", "opción 1"),
+        ("requests", "opción 1 (lectura HTTP)"),
+        ("selenium.webdriver", "opción 1 (Chrome)"),
+        ("sklearn.linear_model", "opción 2 (regresión de respaldo)"),
+    ]
+    for nombre, uso in diferidos:
+        inicio = time.perf_counter()
+        # dir() fuerza la carga de los que están diferidos
+        dir(importlib.import_module(nombre))
+        print(f"  {nombre:<22} {time.perf_counter() - inicio:.3f} s  ({uso})")
+
+
+# ARCHIVO_IMPRESORAS = r"C:\Users\jvargas\Downloads\Impresoras - final.xlsx"
+ARCHIVO_IMPRESORAS = r"G:\Unidades compartidas\Informática\Impresoras - final.xlsx"
+
+
+OUTPUT_FILE = "predicciones_toner_ema.xlsx"
+
+TONER_COLUMNS = ["Toner Negro", "Toner Cian",
+                 "Toner Magenta", "Toner Amarillo"]
+KITS_COLUMNS = ["Kit Mant.", "Kit Alim."]
+CONSUMIBLES = TONER_COLUMNS + KITS_COLUMNS
+
+ESTADO_VALIDO = "OK"
+VENTANA_EMA = 10
+DIAS_ALERTA_CRITICA = 3
+DIAS_ALERTA_MEDIA = 7
+MAX_DIAS_PREDICCION = 365 * 2  # máximo 2 años
+DIAS_HISTORIA_PREDICCION = 180  # lecturas que se cargan para predecir (None = todas)
+
+
+def menu():
+    input_file = ARCHIVO_IMPRESORAS
 
     while True:
         print("\n===== MENÚ =====")
@@ -1019,14 +3017,21 @@ def menu():
         opcion = input("Selecciona una opción: ")
 
         if opcion == "1":
-            procesar_impresoras_hp(input_file, input_file)
-            procesar_color_planta(input_file, input_file)
-            procesar_planta(input_file, input_file)
-            procesar_impresoras_hp_grandes(input_file, input_file)
-            procesar_color_admin(input_file, input_file)
-            format_excel_sheets(input_file)
+            # Un solo pool de navegadores para todas las hojas
+            sesion, controlador, navegador = preparar_consulta()
+            fallos = CacheFallos()
+            with navegador as pool:
+                # Todas las hojas se consultan a la vez y el libro se escribe
+                # una sola vez al final
+                resultados = asyncio.run(escanear_flota(
+                    leer_ips_por_hoja(input_file), pool, sesion, controlador, fallos=fallos))
+            fallos.guardar()
+            actualizar_libro(input_file, resultados, fallos=fallos)
 
         elif opcion == "2":
+            # Se lee recién aquí (y de nuevo cada vez) para incluir lo que
+            # haya agregado la opción 1
+            df = cargar_historico(input_file, CONSUMIBLES, ESTADO_VALIDO, DIAS_HISTORIA_PREDICCION)
             predecir_consumible_promedio(CONSUMIBLES, df, OUTPUT_FILE, DIAS_ALERTA_CRITICA, DIAS_ALERTA_MEDIA, VENTANA_EMA, MAX_DIAS_PREDICCION)
         elif opcion == "0":
             print("👋 Saliendo...")
@@ -1037,4 +3042,67 @@ def menu():
 
 # === EJECUCIÓN ===
 if __name__ == "__main__":
-    menu()
+    parser = argparse.ArgumentParser(description="Niveles de tóner de las impresoras")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="muestra el tiempo de importación al arrancar y el de cada módulo diferido")
+    parser.add_argument("--coordinador", action="store_true",
+                        help="encola las IPs del Excel, espera a los trabajadores y actualiza el libro")
+    parser.add_argument("--trabajador", action="store_true",
+                        help="consulta impresoras tomadas de la cola y entrega los resultados")
+    parser.add_argument("--cola", default=COLA_TRABAJOS,
+                        help="archivo SQLite de la cola (mismo equipo) o host:puerto del coordinador")
+    parser.add_argument("--escuchar", default=None, metavar="HOST:PUERTO",
+                        help="el coordinador publica la cola en esta dirección para trabajadores de otros equipos")
+    parser.add_argument("--excel", default=ARCHIVO_IMPRESORAS,
+                        help="libro de impresoras (coordinador)")
+    parser.add_argument("--subred", default=None,
+                        help='solo tomar IPs con este prefijo, p. ej. "192.168.111."')
+    parser.add_argument("--lote", type=int, default=10,
+                        help="impresoras que toma el trabajador por vez")
+    parser.add_argument("--esperar", action="store_true",
+                        help="el trabajador sigue esperando trabajos con la cola vacía")
+    parser.add_argument("--demonio", action="store_true",
+                        help="consulta continua, cada impresora según su intervalo")
+    parser.add_argument("--intervalo", type=float, default=None,
+                        help="minutos entre lecturas de una impresora sin intervalo propio (demonio)")
+    parser.add_argument("--mapa-ips", default=None,
+                        help="JSON {ip: host:puerto} para consultar otra dirección (p. ej. simulador_ews.py)")
+    parser.add_argument("--prioridad", action="store_true",
+                        help="el demonio lee más seguido las impresoras con menos días de tóner")
+    parser.add_argument("--intervalo-min", type=float, default=5,
+                        help="minutos entre lecturas de la impresora más urgente (--prioridad)")
+    parser.add_argument("--intervalo-max", type=float, default=360,
+                        help="minutos entre lecturas de una impresora llena (--prioridad)")
+    parser.add_argument("--presupuesto", type=float, default=None,
+                        help="máximo de lecturas por hora entre todas las impresoras (--prioridad)")
+    parser.add_argument("--importar-historico", action="store_true",
+                        help="copia la hoja 'Histórico' del Excel al histórico local (Parquet o SQLite, según FORMATO_HISTORICO)")
+    parser.add_argument("--exportar-historico", default=None, metavar="XLSX",
+                        help="escribe el histórico local (Parquet o SQLite) como hoja 'Histórico' de este libro")
+    args = parser.parse_args()
+
+    if args.mapa_ips:
+        cargar_mapa_ips(args.mapa_ips)
+
+    if args.startup_profile:
+        perfil_arranque()
+    elif args.importar_historico:
+        with abrir_historico() as historico:
+            print(f"{historico.importar_excel(args.excel)} lecturas importadas al histórico local")
+    elif args.exportar_historico:
+        with abrir_historico() as historico:
+            print(f"{historico.exportar_excel(args.exportar_historico)} lecturas exportadas a {args.exportar_historico}")
+    elif args.coordinador:
+        coordinar(args.excel, args.cola, escuchar=args.escuchar)
+    elif args.trabajador:
+        trabajar(args.cola, prefijo=args.subred, lote=args.lote, esperar=args.esperar)
+    elif args.demonio:
+        prioridad = None
+        if args.prioridad:
+            prioridad = {'minimo': args.intervalo_min * 60,
+                         'maximo': args.intervalo_max * 60,
+                         'presupuesto_hora': args.presupuesto}
+        demonio(args.excel, args.intervalo * 60 if args.intervalo else None,
+                prioridad=prioridad)
+    else:
+        menu()
@@ -28,26 +28,11 @@ MAX_DIAS_PREDICCION = 365 * 2  # máximo 2 años
 # --------------------------------------------------
 # CARGA Y LIMPIEZA DE DATOS
 # --------------------------------------------------
-df = pd.read_excel(INPUT_FILE, sheet_name="Histórico")
-df.columns = df.columns.str.strip()
-
-df["Fecha de registro"] = pd.to_datetime(
-    df["Marca de Tiempo"], errors="coerce")
-df = df[df["Estado"].str.strip() == ESTADO_VALIDO].copy()
-
-for col in CONSUMIBLES:
-    df[col] = (
-        df[col]
-        .astype(str)
-        .str.replace("%", "", regex=False)
-        .str.strip()
-        .replace("", np.nan)
-        .astype(float)
-    )
-
-df.sort_values("Fecha de registro", ascending=False, inplace=True)
-df.drop_duplicates(subset=["IP", "Marca de Tiempo"],
-                   keep="first", inplace=True)
+# Misma carga que la opción 2 de menu.py: del histórico local y solo las
+# lecturas de la ventana que usa la predicción
+from menu import cargar_historico, DIAS_HISTORIA_PREDICCION
+
+df = cargar_historico(INPUT_FILE, CONSUMIBLES, ESTADO_VALIDO, DIAS_HISTORIA_PREDICCION)
 
 # --------------------------------------------------
 # FUNCIÓN DE PREDICCIÓN (EMA + FALLBACK)
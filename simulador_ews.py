@@ -0,0 +1,443 @@
+"""
+Flota de impresoras falsas para probar y medir menu.py sin la red real.
+
+Levanta un servidor HTTP por impresora en 127.0.0.1 (un puerto cada una)
+con las mismas páginas que leen los perfiles de menu.py:
+  - HP EWS: SupplyName<n> / SupplyGauge<n>
+  - Samsung SWS: frame ruifw_MainFrm con las tablas toner_list e imagine_list
+  - Samsung CLX-6260: grilla ExtJS (.x-grid3-row) armada por JavaScript
+Las HP responden además por SNMP (tabla prtMarkerSupplies del Printer-MIB)
+en el mismo número de puerto, por UDP.
+
+Cada impresora tiene una IP inventada; el archivo de --mapa relaciona esa IP
+con su puerto local y se le pasa a menu.py con --mapa-ips. Con --excel se
+genera además un libro con las hojas correspondientes.
+
+Ejemplo:
+    python simulador_ews.py --hp 80 --samsung 10 --clx 10 --latencia 200 --jitter 150 \\
+        --timeouts 0.02 --errores 0.02 --caidas 0.05 --excel flota.xlsx
+    python menu.py --mapa-ips mapa_simulador.json --excel flota.xlsx --coordinador
+"""
+
+import argparse
+import json
+import random
+import selectors
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COLORES = ["Negro", "Cian", "Magenta", "Amarillo"]
+
+ESTILO = "body { font-family: sans-serif; } .x-grid3-row { height: 22px; }"
+
+# PNG de 1x1 para que el modo liviano tenga algo que bloquear
+LOGO = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082")
+
+
+def niveles_al_azar(cantidad, rng):
+    # Algunas impresoras casi vacías para que se vean las alertas
+    return [rng.choice([rng.randint(0, 10), rng.randint(10, 100)]) for _ in range(cantidad)]
+
+
+def pagina_hp(niveles, incompleta=False):
+    nombres = ["Black Cartridge", "Maintenance Kit", "Document Feeder Kit",
+               "Cyan Cartridge", "Magenta Cartridge"]
+    filas = []
+    for i, nivel in enumerate(niveles):
+        if incompleta and i == 0:
+            continue
+        filas.append(
+            f'<tr><td><span id="SupplyName{i}">{nombres[i % len(nombres)]}</span></td>'
+            f'<td><div class="gauge"><span id="SupplyGauge{i}">{nivel}%</span></div></td></tr>')
+    return (
+        '<html><head><title>HP LaserJet</title>'
+        '<link rel="stylesheet" href="/estilo.css"></head><body>'
+        '<img src="/logo.png"><table id="SupplyTable">' + "".join(filas) +
+        '</table></body></html>')
+
+
+def _tabla_samsung(id_tabla, niveles):
+    filas = []
+    for i, nivel in enumerate(niveles, start=1):
+        filas.append(
+            f'<tr id="{i}"><td>{COLORES[(i - 1) % 4]}</td><td><table><tbody><tr><td>'
+            f'<table><tbody><tr><td class="barra"></td>'
+            f'<td class="tonervalue_number">{nivel}%</td></tr></tbody></table>'
+            f'</td></tr></tbody></table></td></tr>')
+    return f'<table id="{id_tabla}"><tbody>{"".join(filas)}</tbody></table>'
+
+
+def pagina_samsung():
+    return (
+        '<html><head><title>SyncThru Web Service</title>'
+        '<link rel="stylesheet" href="/estilo.css"></head><body>'
+        '<iframe id="ruifw_MainFrm" src="/sws/marco.html"></iframe></body></html>')
+
+
+def marco_samsung(toner, unidades, incompleta=False):
+    tablas = _tabla_samsung("toner_list", toner)
+    if not incompleta:
+        tablas += _tabla_samsung("imagine_list", unidades)
+    return f'<html><body><img src="/logo.png">{tablas}</body></html>'
+
+
+def pagina_clx(niveles, incompleta=False, demora_ms=300):
+    filas = "".join(
+        '<div class="x-grid3-row"><table><tbody><tr>'
+        f'<td class="x-column">{COLORES[i]}</td><td class="x-column">{nivel}%</td>'
+        '</tr></tbody></table></div>'
+        for i, nivel in enumerate(niveles[:3] if incompleta else niveles))
+    # Como ExtJS, la grilla aparece un rato después de cargar la página
+    return (
+        '<html><head><title>CLX-6260</title>'
+        '<link rel="stylesheet" href="/estilo.css"></head><body>'
+        '<div id="grilla" class="x-grid3-body"></div>'
+        f'<script>setTimeout(function () {{ document.getElementById("grilla").innerHTML = '
+        f'{json.dumps(filas)}; }}, {demora_ms});</script></body></html>')
+
+
+class Impresora:
+    """Estado y comportamiento de una impresora simulada."""
+
+    def __init__(self, ip, tipo, puerto, rng, opciones):
+        self.ip = ip
+        self.tipo = tipo
+        self.puerto = puerto
+        self.rng = random.Random(rng.random())
+        self.opciones = opciones
+        self.caida = rng.random() < opciones.caidas
+        self.niveles = niveles_al_azar(5 if tipo == "hp" else 4, rng)
+        self.unidades = niveles_al_azar(4, rng)
+        self.lock = threading.Lock()
+
+    def consumir(self):
+        # Cada lectura gasta un poco, para que el histórico tenga pendiente
+        with self.lock:
+            i = self.rng.randrange(len(self.niveles))
+            self.niveles[i] = max(0, self.niveles[i] - self.rng.choice([0, 0, 1]))
+
+    def demora(self):
+        return max(0.0, self.opciones.latencia + self.rng.uniform(
+            -self.opciones.jitter, self.opciones.jitter)) / 1000
+
+    def pagina(self, ruta):
+        incompleta = self.rng.random() < self.opciones.incompletas
+        if ruta == "/estilo.css":
+            return "text/css", ESTILO.encode()
+        if ruta == "/logo.png":
+            return "image/png", LOGO
+        if self.tipo == "hp":
+            html = pagina_hp(self.niveles, incompleta)
+        elif self.tipo == "samsung":
+            html = marco_samsung(self.niveles, self.unidades, incompleta) \
+                if ruta.startswith("/sws/") else pagina_samsung()
+        else:
+            html = pagina_clx(self.niveles, incompleta)
+        return "text/html; charset=utf-8", html.encode()
+
+
+def crear_manejador(impresora):
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            ruta = self.path.split("?")[0]
+            time.sleep(impresora.demora())
+
+            azar = impresora.rng.random()
+            if azar < impresora.opciones.timeouts:
+                # No contesta: el colector tiene que cortar por timeout
+                time.sleep(impresora.opciones.colgada)
+                return
+            if azar < impresora.opciones.timeouts + impresora.opciones.errores:
+                self.send_error(500, "Error interno simulado")
+                return
+
+            tipo, cuerpo = impresora.pagina(ruta)
+            if ruta in ("/", "/index.html"):
+                impresora.consumir()
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    return Manejador
+
+
+# Agente SNMP: GetNext (v1) y GetBulk (v2c) sobre prtMarkerSupplies
+
+OID_SUMINISTROS = "1.3.6.1.2.1.43.11.1.1"
+NOMBRES_SNMP = ["Black Cartridge", "Maintenance Kit", "Document Feeder Kit",
+                "Cyan Cartridge", "Magenta Cartridge"]
+
+
+def _oid_a_tupla(oid):
+    return tuple(int(p) for p in oid.split("."))
+
+
+def tabla_snmp(impresora):
+    """[(oid, tag, valor)] ordenada como la recorre un GetNext."""
+    filas = []
+    for columna in (6, 8, 9):  # descripción, capacidad, nivel
+        for i, nivel in enumerate(impresora.niveles, start=1):
+            oid = f"{OID_SUMINISTROS}.{columna}.1.{i}"
+            if columna == 6:
+                filas.append((oid, 0x04, NOMBRES_SNMP[(i - 1) % len(NOMBRES_SNMP)]))
+            else:
+                filas.append((oid, 0x02, 100 if columna == 8 else nivel))
+    return sorted(filas, key=lambda fila: _oid_a_tupla(fila[0]))
+
+
+def _siguiente(tabla, oid):
+    clave = _oid_a_tupla(oid)
+    for fila in tabla:
+        if _oid_a_tupla(fila[0]) > clave:
+            return fila
+    return None
+
+
+# Codificación BER propia del agente, independiente de la de menu.py para
+# que un error en el cliente no quede oculto por el mismo error aquí
+
+def _tlv(tag, contenido):
+    largo = len(contenido)
+    if largo < 0x80:
+        return bytes([tag, largo]) + contenido
+    octetos = largo.to_bytes((largo.bit_length() + 7) // 8, "big")
+    return bytes([tag, 0x80 | len(octetos)]) + octetos + contenido
+
+
+def _codificar_entero(valor):
+    octetos = valor.to_bytes(valor.bit_length() // 8 + 1, "big", signed=True)
+    return _tlv(0x02, octetos)
+
+
+def _codificar_oid(oid):
+    numeros = _oid_a_tupla(oid)
+    contenido = bytearray([40 * numeros[0] + numeros[1]])
+    for numero in numeros[2:]:
+        septetos = []
+        while True:
+            septetos.append(numero & 0x7F)
+            numero >>= 7
+            if not numero:
+                break
+        # Todos los septetos menos el último llevan el bit de continuación
+        contenido.extend(b | 0x80 for b in reversed(septetos[1:]))
+        contenido.append(septetos[0])
+    return _tlv(0x06, bytes(contenido))
+
+
+def _decodificar(datos):
+    """Lista de (tag, contenido) de los TLV seguidos en `datos`."""
+    elementos, pos = [], 0
+    while pos < len(datos):
+        if pos + 2 > len(datos):
+            raise ValueError("TLV incompleto")
+        tag, largo = datos[pos], datos[pos + 1]
+        pos += 2
+        if largo & 0x80:
+            cantidad = largo & 0x7F
+            if not cantidad or pos + cantidad > len(datos):
+                raise ValueError("largo BER inválido")
+            largo = int.from_bytes(datos[pos:pos + cantidad], "big")
+            pos += cantidad
+        if pos + largo > len(datos):
+            raise ValueError("TLV truncado")
+        elementos.append((tag, datos[pos:pos + largo]))
+        pos += largo
+    return elementos
+
+
+def _decodificar_entero(contenido):
+    return int.from_bytes(contenido, "big", signed=True)
+
+
+def _decodificar_oid(contenido):
+    primero = contenido[0]
+    numeros = [min(primero // 40, 2), primero - 40 * min(primero // 40, 2)]
+    actual = 0
+    for byte in contenido[1:]:
+        actual = actual * 128 + (byte & 0x7F)
+        if byte < 0x80:
+            numeros.append(actual)
+            actual = 0
+    return ".".join(map(str, numeros))
+
+
+def respuesta_snmp(impresora, datos):
+    (_, mensaje), = _decodificar(datos)
+    (_, version), (_, comunidad), (tag_pdu, contenido_pdu) = _decodificar(mensaje)
+    campos = _decodificar(contenido_pdu)
+    id_peticion = _decodificar_entero(campos[0][1])
+    oids = [_decodificar_oid(_decodificar(varbind)[0][1])
+            for _, varbind in _decodificar(campos[3][1])]
+
+    tabla = tabla_snmp(impresora)
+    repeticiones = _decodificar_entero(campos[2][1]) if tag_pdu == 0xA5 else 1
+    varbinds, error = [], 0
+    cursores = list(oids)
+    for _ in range(repeticiones):
+        for n, cursor in enumerate(cursores):
+            fila = _siguiente(tabla, cursor)
+            if fila is None:
+                if tag_pdu != 0xA5:
+                    error = 2  # noSuchName en v1
+                varbinds.append(_tlv(0x30, _codificar_oid(cursor) + _tlv(0x82, b"")))
+                continue
+            oid, tag, valor = fila
+            codificado = _codificar_entero(valor) if tag == 0x02 else _tlv(0x04, valor.encode())
+            varbinds.append(_tlv(0x30, _codificar_oid(oid) + codificado))
+            cursores[n] = oid
+
+    pdu = _tlv(0xA2, _codificar_entero(id_peticion) + _codificar_entero(error) +
+               _codificar_entero(0) + _tlv(0x30, b"".join(varbinds)))
+    return _tlv(0x30, _codificar_entero(_decodificar_entero(version)) +
+                _tlv(0x04, comunidad) + pdu)
+
+
+def levantar_snmp(flota):
+    """Un solo hilo atiende los sockets UDP de todas las impresoras."""
+    selector = selectors.DefaultSelector()
+    for impresora in flota:
+        if impresora.caida or impresora.tipo != "hp":
+            continue
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", impresora.puerto))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, impresora)
+
+    def atender():
+        while True:
+            for clave, _ in selector.select():
+                impresora = clave.data
+                try:
+                    datos, origen = clave.fileobj.recvfrom(65535)
+                except OSError:
+                    continue
+                if impresora.rng.random() < impresora.opciones.timeouts:
+                    continue
+                try:
+                    respuesta = respuesta_snmp(impresora, datos)
+                except (IndexError, ValueError):
+                    continue
+                # La demora va en otro hilo para no frenar a las demás
+                threading.Timer(impresora.demora(), clave.fileobj.sendto,
+                                (respuesta, origen)).start()
+
+    threading.Thread(target=atender, daemon=True).start()
+    return len(selector.get_map())
+
+
+def crear_flota(opciones):
+    rng = random.Random(opciones.semilla)
+    tipos = (["hp"] * opciones.hp + ["samsung"] * opciones.samsung +
+             ["clx"] * opciones.clx)
+    flota = []
+    for n, tipo in enumerate(tipos):
+        # IPs inventadas 192.168.2xx.yy: format_ip de menu.py espera el
+        # tercer octeto de 3 dígitos y el último de al menos 2
+        ip = f"192.168.{200 + n // 245}.{n % 245 + 10}"
+        flota.append(Impresora(ip, tipo, opciones.puerto_base + n, rng, opciones))
+    return flota
+
+
+def levantar(flota):
+    servidores = []
+    for impresora in flota:
+        if impresora.caida:
+            # Puerto cerrado: conexión rechazada, como una impresora apagada
+            continue
+        servidor = ThreadingHTTPServer(("127.0.0.1", impresora.puerto), crear_manejador(impresora))
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        servidores.append(servidor)
+    return servidores
+
+
+def guardar_mapa(flota, ruta):
+    mapa = {impresora.ip: f"127.0.0.1:{impresora.puerto}" for impresora in flota}
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(mapa, f, indent=2)
+
+
+def guardar_excel(flota, ruta):
+    """Libro con las mismas hojas y columnas que usa menu.py."""
+    from openpyxl import Workbook
+
+    hojas = {
+        "hp": ("HP Admin", ["Toner Negro", "Kit Mant.", "Kit Alim."]),
+        "samsung": ("Impresoras a Color", ["Toner Negro", "UI Negro", "Toner Cian", "UI Cian",
+                                           "Toner Magenta", "UI Magenta", "Toner Amarillo", "UI Amarillo"]),
+        "clx": ("Impresora CLX-6260", ["Toner Negro", "Toner Cian", "Toner Magenta", "Toner Amarillo"]),
+    }
+    wb = Workbook()
+    wb.remove(wb.active)
+    for tipo, (nombre, columnas) in hojas.items():
+        impresoras = [impresora for impresora in flota if impresora.tipo == tipo]
+        if not impresoras:
+            continue
+        ws = wb.create_sheet(nombre)
+        ws.append(["Nombre", "IP", "Modelo"] + columnas + ["Estado", "Marca de Tiempo"])
+        for n, impresora in enumerate(impresoras, start=1):
+            ws.append([f"{nombre} {n}", impresora.ip, tipo.upper()] +
+                      [None] * len(columnas) + [None, None])
+    wb.create_sheet("Histórico").append(
+        ["Nombre", "IP", "Modelo", "Toner Negro", "Toner Cian", "Toner Magenta",
+         "Toner Amarillo", "Kit Mant.", "Kit Alim.", "Estado", "Marca de Tiempo"])
+    wb.save(ruta)
+
+
+def argumentos(args=None):
+    parser = argparse.ArgumentParser(description="Flota de impresoras simuladas en 127.0.0.1")
+    parser.add_argument("--hp", type=int, default=20, help="impresoras HP EWS")
+    parser.add_argument("--samsung", type=int, default=5, help="impresoras Samsung SWS")
+    parser.add_argument("--clx", type=int, default=2, help="impresoras Samsung CLX-6260")
+    parser.add_argument("--puerto-base", type=int, default=18000)
+    parser.add_argument("--latencia", type=float, default=100, help="ms por respuesta")
+    parser.add_argument("--jitter", type=float, default=50, help="± ms al azar sobre la latencia")
+    parser.add_argument("--timeouts", type=float, default=0.0,
+                        help="probabilidad de que una petición no responda")
+    parser.add_argument("--colgada", type=float, default=60,
+                        help="segundos que queda colgada una petición que no responde")
+    parser.add_argument("--errores", type=float, default=0.0, help="probabilidad de un HTTP 500")
+    parser.add_argument("--incompletas", type=float, default=0.0,
+                        help="probabilidad de una página sin los consumibles")
+    parser.add_argument("--caidas", type=float, default=0.0,
+                        help="proporción de impresoras apagadas (puerto cerrado)")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--mapa", default="mapa_simulador.json",
+                        help="archivo IP -> 127.0.0.1:puerto para menu.py --mapa-ips")
+    parser.add_argument("--excel", default=None, help="genera un libro con la flota")
+    parser.add_argument("--sin-snmp", dest="snmp", action="store_false",
+                        help="no levantar los agentes SNMP de las HP")
+    return parser.parse_args(args)
+
+
+def main():
+    opciones = argumentos()
+    flota = crear_flota(opciones)
+    servidores = levantar(flota)
+    agentes = levantar_snmp(flota) if opciones.snmp else 0
+    guardar_mapa(flota, opciones.mapa)
+    if opciones.excel:
+        guardar_excel(flota, opciones.excel)
+    print(f"{len(servidores)} impresoras escuchando ({len(flota) - len(servidores)} apagadas), "
+          f"puertos {opciones.puerto_base}-{opciones.puerto_base + len(flota) - 1}. "
+          f"{agentes} agentes SNMP. Mapa en {opciones.mapa}. Ctrl+C para terminar.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for servidor in servidores:
+            servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()